@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Upstream transport benchmark against local stub servers
+
+Runs the same concurrent chat-completion load through GrokAPI with each
+transport and compares latency, throughput and TCP connections opened.
+With --loops it repeats the run under each event loop implementation and
+reports how far the loop fell behind its timers while under load.
+
+    python bench_grok.py --requests 1000 --concurrency 200 --latency 0.05
+    python bench_grok.py --loops asyncio,uvloop
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Any, List
+
+from aiohttp import web
+
+from grok_looplag import LoopMonitor
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    h2 = None
+
+
+def completion_body(request: Dict[str, Any]) -> bytes:
+    """Canned chat completion echoing the query"""
+    query = request['messages'][0]['content']
+    return json.dumps({
+        'model': request.get('model'),
+        'choices': [{'message': {'role': 'assistant', 'content': f'echo: {query}'}}],
+        'usage': {'prompt_tokens': 12, 'completion_tokens': 8, 'total_tokens': 20}
+    }).encode()
+
+
+class StubStats:
+    def __init__(self):
+        self.connections = 0
+        self.requests = 0
+        self.transports = set()
+
+
+async def start_http1_stub(port: int, latency: float, stats: StubStats) -> web.AppRunner:
+    """HTTP/1.1 upstream stub on aiohttp"""
+
+    async def completions(request):
+        stats.requests += 1
+        # Each keep-alive connection has its own transport
+        if request.transport not in stats.transports:
+            stats.transports.add(request.transport)
+            stats.connections += 1
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return web.Response(body=completion_body(body), content_type='application/json')
+
+    async def models(request):
+        return web.json_response({'data': []})
+
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', completions)
+    app.router.add_get('/v1/models', models)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    return runner
+
+
+class H2StubProtocol(asyncio.Protocol):
+    """Cleartext HTTP/2 (prior knowledge) upstream stub on the h2 state machine"""
+
+    def __init__(self, latency: float, stats: StubStats):
+        self.latency = latency
+        self.stats = stats
+        self.conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+        self.streams = {}
+
+    def connection_made(self, transport):
+        self.stats.connections += 1
+        self.transport = transport
+        self.conn.initiate_connection()
+        self.transport.write(self.conn.data_to_send())
+
+    def data_received(self, data: bytes):
+        for event in self.conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                self.streams[event.stream_id] = {'headers': dict(event.headers), 'body': b''}
+            elif isinstance(event, h2.events.DataReceived):
+                self.streams[event.stream_id]['body'] += event.data
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                asyncio.create_task(self.respond(event.stream_id))
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                self.transport.close()
+        self.transport.write(self.conn.data_to_send())
+
+    async def respond(self, stream_id: int):
+        stream = self.streams.pop(stream_id)
+        if stream['headers'].get(b':path', b'').endswith(b'/chat/completions'):
+            self.stats.requests += 1
+            await asyncio.sleep(self.latency)
+            body = completion_body(json.loads(stream['body']))
+        else:
+            body = b'{"data": []}'
+        if self.transport.is_closing():
+            return
+        self.conn.send_headers(stream_id, [
+            (':status', '200'),
+            ('content-type', 'application/json'),
+            ('content-length', str(len(body)))
+        ])
+        self.conn.send_data(stream_id, body, end_stream=True)
+        self.transport.write(self.conn.data_to_send())
+
+
+async def start_http2_stub(port: int, latency: float, stats: StubStats) -> asyncio.AbstractServer:
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: H2StubProtocol(latency, stats), '127.0.0.1', port)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def run_load(transport: str, port: int, requests: int, concurrency: int) -> Dict[str, Any]:
+    os.environ['XAI_API_BASE_URL'] = f'http://127.0.0.1:{port}/v1'
+    os.environ['GROK_UPSTREAM_TRANSPORT'] = transport
+    # Measure the transport, not the adaptive limiter (set GROK_LIMIT_ALGORITHM to include it)
+    os.environ.setdefault('GROK_LIMIT_ALGORITHM', 'fixed')
+    os.environ.setdefault('GROK_UPSTREAM_CONCURRENCY', str(concurrency))
+    os.environ.setdefault('GROK_LIMIT_MAX', str(concurrency))
+    from grok_api import GrokAPI
+    grok = GrokAPI()
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            result = await grok.chat_completion(f'benchmark query {i}')
+            latencies.append(time.perf_counter() - started)
+            if not result['success']:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    transport_stats = grok.transport.stats()
+    await grok.close()
+
+    return {
+        'transport': transport_stats['transport'],
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': requests / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'client_connections': transport_stats['connections_opened']
+    }
+
+
+async def bench_transports(args) -> List[Dict[str, Any]]:
+    results = []
+    for transport in args.transports.split(','):
+        stats = StubStats()
+        if transport == 'http2':
+            if h2 is None:
+                print('⚠️ Skipping http2: `pip install httpx[http2]` first')
+                continue
+            server = await start_http2_stub(args.port, args.latency, stats)
+            cleanup = server.close
+        else:
+            runner = await start_http1_stub(args.port, args.latency, stats)
+            cleanup = runner.cleanup
+        monitor = LoopMonitor(interval=0.01, slow_callback_ms=0)
+        monitor.start()
+        try:
+            result = await run_load(transport, args.port, args.requests, args.concurrency)
+            result['server_connections'] = stats.connections
+            lag = monitor.stats()
+            result['loop'] = lag['loop'].split('.')[0]
+            result['loop_lag_p99_ms'] = lag['lag_ms']['p99']
+            result['loop_lag_max_ms'] = lag['lag_ms']['max']
+            results.append(result)
+        finally:
+            monitor.stop()
+            outcome = cleanup()
+            if asyncio.iscoroutine(outcome):
+                await outcome
+    return results
+
+
+def print_table(title: str, results: List[Dict[str, Any]]):
+    print(f'\n{title}')
+    header = (f"{'loop':<8} {'transport':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'lag p99':>8} {'lag max':>8} {'conns':>6} {'errors':>6}")
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['loop']:<8} {r['transport']:<10} {r['throughput_rps']:>8.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['loop_lag_p99_ms'] or 0:>8.1f} "
+              f"{r['loop_lag_max_ms']:>8.1f} {r['server_connections']:>6} {r['errors']:>6}")
+
+
+def loop_policy(name: str):
+    """Event loop policy for --loops, or None when it is not installed"""
+    if name == 'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            return None
+        return uvloop.EventLoopPolicy()
+    return asyncio.DefaultEventLoopPolicy()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GrokAPI transports against local stubs')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub upstream latency in seconds')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--transports', default='aiohttp,http2')
+    parser.add_argument('--loops', default='asyncio', help='event loops to compare, e.g. asyncio,uvloop')
+    parser.add_argument('--json', action='store_true', help='print raw results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for name in args.loops.split(','):
+        policy = loop_policy(name)
+        if policy is None:
+            print(f'⚠️ Skipping {name}: `pip install {name}` first')
+            continue
+        asyncio.set_event_loop_policy(policy)
+        results.extend(asyncio.run(bench_transports(args)))
+    asyncio.set_event_loop_policy(None)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(f'{args.requests} requests, concurrency {args.concurrency}, '
+                    f'stub latency {args.latency * 1000:.0f}ms', results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Admission control and load shedding for Grok queries
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Any
+
+from grok_tracing import span
+
+# Lanes in priority order: interactive WebSocket queries go ahead of batch REST calls
+LANES = ('interactive', 'batch')
+
+
+class AdmissionRejected(Exception):
+    """Raised when a query is shed instead of queued"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded, prioritised wait queue"""
+
+    def __init__(self, max_concurrent: int = None, max_queue: int = None, max_wait: float = None):
+        if max_concurrent is None:
+            max_concurrent = int(os.getenv('GROK_MAX_CONCURRENT', '16'))
+        if max_queue is None:
+            max_queue = int(os.getenv('GROK_MAX_QUEUE', '64'))
+        if max_wait is None:
+            max_wait = float(os.getenv('GROK_MAX_QUEUE_WAIT', '10'))
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.active = 0
+        self.waiters = {lane: deque() for lane in LANES}
+        self.avg_service_time = 1.0  # seconds, EWMA of slot hold time
+        self.avg_wait_time = 0.0     # seconds, EWMA of queue wait
+        self.max_wait_seen = 0.0
+        self.admitted = {lane: 0 for lane in LANES}
+        self.shed = {lane: 0 for lane in LANES}
+
+    def queued(self, lane: str = None) -> int:
+        if lane is None:
+            return sum(len(q) for q in self.waiters.values())
+        return len(self.waiters[lane])
+
+    def expected_wait(self, lane: str) -> float:
+        """Estimated queue wait for a new arrival in this lane"""
+        ahead = sum(len(self.waiters[l]) for l in LANES[:LANES.index(lane) + 1])
+        if self.active < self.max_concurrent and ahead == 0:
+            return 0.0
+        return (ahead + 1) / self.max_concurrent * self.avg_service_time
+
+    async def acquire(self, lane: str):
+        if self.active < self.max_concurrent and self.queued() == 0:
+            self.active += 1
+            self.admitted[lane] += 1
+            return
+
+        expected = self.expected_wait(lane)
+        if self.queued() >= self.max_queue and not self._evict_below(lane, expected):
+            self.shed[lane] += 1
+            raise AdmissionRejected('queue full', max(1, math.ceil(expected)))
+        if expected > self.max_wait:
+            self.shed[lane] += 1
+            raise AdmissionRejected('expected wait too long', max(1, math.ceil(expected)))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append(waiter)
+        started = time.monotonic()
+        try:
+            with span('admission.wait', lane=lane, queued=self.queued()):
+                await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.exception() is None:
+                # The slot was handed over just as we were cancelled; pass it on
+                self.release()
+            elif waiter in self.waiters[lane]:
+                self.waiters[lane].remove(waiter)
+            raise
+        waited = time.monotonic() - started
+        self.avg_wait_time = 0.8 * self.avg_wait_time + 0.2 * waited
+        self.max_wait_seen = max(self.max_wait_seen, waited)
+        self.admitted[lane] += 1
+
+    def _evict_below(self, lane: str, expected: float) -> bool:
+        """Make room by shedding the newest waiter from a lower-priority lane"""
+        for lower in reversed(LANES[LANES.index(lane) + 1:]):
+            queue = self.waiters[lower]
+            while queue:
+                waiter = queue.pop()
+                if not waiter.done():
+                    self.shed[lower] += 1
+                    waiter.set_exception(AdmissionRejected('preempted', max(1, math.ceil(expected))))
+                    return True
+        return False
+
+    def release(self, service_time: float = None):
+        if service_time is not None:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * service_time
+        for lane in LANES:
+            queue = self.waiters[lane]
+            while queue:
+                waiter = queue.popleft()
+                if not waiter.done():
+                    # Hand the slot straight to the next waiter
+                    waiter.set_result(None)
+                    return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        """Hold one query slot; raises AdmissionRejected when the server is overloaded"""
+        await self.acquire(lane)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'active': self.active,
+            'max_concurrent': self.max_concurrent,
+            'queued': self.queued(),
+            'max_queue': self.max_queue,
+            'lanes': {
+                lane: {
+                    'queued': len(self.waiters[lane]),
+                    'expected_wait_s': round(self.expected_wait(lane), 3),
+                    'admitted': self.admitted[lane],
+                    'shed': self.shed[lane]
+                }
+                for lane in LANES
+            },
+            'avg_wait_s': round(self.avg_wait_time, 3),
+            'max_wait_s': round(self.max_wait_seen, 3),
+            'avg_service_s': round(self.avg_service_time, 3),
+            'max_queue_wait_s': self.max_wait
+        }
@@ -4,28 +4,236 @@ Official xAI Grok API Integration with SSL fix for macOS
 
 import os
 import json
-import aiohttp
-import ssl
-import certifi
+import asyncio
+import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
+from grok_tracing import span
+from grok_transport import Transport, make_transport
+from grok_cache import ResponseCache
+from grok_offload import offload
+from grok_limiter import AdaptiveLimiter
 
 load_dotenv()
 
+DEFAULT_MODEL = "grok-2"
+
+
+class UpstreamBackend:
+    """One API key on one endpoint, with its own health and usage"""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        key_hint = api_key[-4:] if api_key else 'none'
+        self.name = f"{urlsplit(self.base_url).hostname}/…{key_hint}"
+
+        self.outstanding = 0
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.tokens = 0
+        self.avg_latency = 0.0
+        self.last_error = None
+
+    def healthy(self, now: float) -> bool:
+        return self.down_until <= now
+
+    def record_success(self, latency: float, usage: Dict[str, Any]):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.tokens += usage.get('total_tokens', 0)
+        self.avg_latency = latency if self.successes == 1 else 0.8 * self.avg_latency + 0.2 * latency
+
+    def record_failure(self, error: str, max_failures: int, cooldown: float):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.consecutive_failures >= max_failures:
+            # Take the backend out for a while; the next request after that probes it
+            self.down_until = time.monotonic() + cooldown
+            self.consecutive_failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        down_for = self.down_until - time.monotonic()
+        return {
+            'endpoint': self.base_url,
+            'healthy': down_for <= 0,
+            'down_for_s': round(down_for, 1) if down_for > 0 else 0,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'tokens': self.tokens,
+            'avg_latency_ms': round(self.avg_latency * 1000, 1),
+            'last_error': self.last_error
+        }
+
+
+class BackendPool:
+    """Routes each request to the healthy backend with the fewest outstanding requests"""
+
+    def __init__(self, backends: List[UpstreamBackend]):
+        self.backends = backends
+        self.max_failures = int(os.getenv('GROK_BACKEND_MAX_FAILURES', '3'))
+        self.cooldown = float(os.getenv('GROK_BACKEND_COOLDOWN', '30'))
+
+    @classmethod
+    def from_env(cls) -> 'BackendPool':
+        """Every key in XAI_API_KEYS on every endpoint in XAI_API_BASE_URLS"""
+        keys = _split(os.getenv('XAI_API_KEYS')) or [os.getenv('XAI_API_KEY')]
+        urls = _split(os.getenv('XAI_API_BASE_URLS')) or [os.getenv('XAI_API_BASE_URL', 'https://api.x.ai/v1')]
+        return cls([UpstreamBackend(url, key) for url in urls for key in keys])
+
+    def pick(self, exclude: Set[UpstreamBackend] = frozenset()) -> Optional[UpstreamBackend]:
+        candidates = [b for b in self.backends if b not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [b for b in candidates if b.healthy(now)]
+        if not healthy:
+            # Everything is cooling down: use whichever comes back first
+            return min(candidates, key=lambda b: b.down_until)
+        return min(healthy, key=lambda b: (b.outstanding, b.requests))
+
+    def endpoints(self) -> List[str]:
+        return list(dict.fromkeys(b.base_url for b in self.backends))
+
+    def stats(self) -> Dict[str, Any]:
+        return {b.name: b.stats() for b in self.backends}
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
 class GrokAPI:
     def __init__(self):
-        self.api_key = os.getenv('XAI_API_KEY')
-        self.base_url = os.getenv('XAI_API_BASE_URL', 'https://api.x.ai/v1')
-        
-    async def chat_completion(self, query: str, model: str = "grok-2") -> Dict[str, Any]:
-        """Make a chat completion request to Grok API"""
-        
-        headers = {
-            'Authorization': f'Bearer {self.api_key}',
-            'Content-Type': 'application/json'
+        self.pool = BackendPool.from_env()
+        self.api_key = self.pool.backends[0].api_key
+        self.base_url = self.pool.backends[0].base_url
+        self.retries = int(os.getenv('GROK_UPSTREAM_RETRIES', '1'))
+
+        # Connection pool settings
+        self.transport: Transport = make_transport(
+            self.pool.endpoints(),
+            pool_size=int(os.getenv('GROK_UPSTREAM_POOL_SIZE', '100')),
+            keepalive_timeout=float(os.getenv('GROK_KEEPALIVE_TIMEOUT', '60')),
+            dns_ttl=int(os.getenv('GROK_DNS_TTL', '300'))
+        )
+        self.warm_connections = int(os.getenv('GROK_WARM_CONNECTIONS', '4'))
+        self.warm_refresh_interval = float(os.getenv('GROK_WARM_REFRESH_INTERVAL', '30'))
+
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.last_request_at = 0.0
+        self.warm_status: Dict[str, Any] = {'state': 'cold'}
+        self.cache = ResponseCache()
+        self.limiter = AdaptiveLimiter()
+
+    async def warm_up(self, timeout: float = None) -> Dict[str, Any]:
+        """Resolve DNS and open warm keep-alive connections to every endpoint"""
+        if timeout is None:
+            timeout = float(os.getenv('GROK_WARMUP_TIMEOUT', '10'))
+
+        started = time.perf_counter()
+        self.warm_status = {'state': 'warming'}
+        loop = asyncio.get_running_loop()
+        endpoints = {}
+
+        for base_url in self.pool.endpoints():
+            parts = urlsplit(base_url)
+            port = parts.port or (443 if parts.scheme == 'https' else 80)
+            try:
+                infos = await asyncio.wait_for(loop.getaddrinfo(parts.hostname, port), timeout)
+            except Exception as e:
+                endpoints[base_url] = {'stage': 'dns', 'error': str(e), 'connections': 0}
+                continue
+            endpoints[base_url] = {
+                'addresses': sorted({info[4][0] for info in infos}),
+                'connections': await self._open_connections(base_url, self.warm_connections, timeout)
+            }
+
+        opened = sum(e['connections'] for e in endpoints.values())
+        self.warm_status = {
+            'state': 'warm' if opened or not self.warm_connections else 'failed',
+            'endpoints': endpoints,
+            'connections': opened,
+            'requested': self.warm_connections * len(endpoints),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            'at': datetime.now().isoformat(timespec='seconds')
+        }
+        return self.warm_status
+
+    async def _open_connections(self, base_url: str, count: int, timeout: float) -> int:
+        """Issue concurrent lightweight requests so each leaves a pooled connection behind"""
+        url = f"{base_url}/models"
+        backend = next(b for b in self.pool.backends if b.base_url == base_url)
+        headers = {'Authorization': f'Bearer {backend.api_key}'}
+
+        async def touch():
+            # Any HTTP response means the TCP + TLS connection is up and reusable
+            await self.transport.request('GET', url, headers)
+
+        results = await asyncio.gather(
+            *(asyncio.wait_for(touch(), timeout) for _ in range(count)),
+            return_exceptions=True
+        )
+        return sum(1 for r in results if not isinstance(r, BaseException))
+
+    def start_refresh(self):
+        """Keep the pool warm during quiet periods"""
+        if self._refresh_task is None and self.warm_refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.warm_refresh_interval)
+            # Real traffic keeps connections alive on its own
+            if time.monotonic() - self.last_request_at < self.warm_refresh_interval:
+                continue
+            try:
+                opened = 0
+                for base_url in self.pool.endpoints():
+                    opened += await self._open_connections(base_url, self.warm_connections,
+                                                           self.warm_refresh_interval)
+                self.warm_status['connections'] = opened
+                self.warm_status['refreshed_at'] = datetime.now().isoformat(timespec='seconds')
+            except Exception as e:
+                self.warm_status['refresh_error'] = str(e)
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        await self.transport.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backends': self.pool.stats(),
+            'retries': self.retries,
+            'transport': self.transport.stats(),
+            'warm': self.warm_status,
+            'cache': self.cache.stats(),
+            'limiter': self.limiter.stats(history=10)
         }
-        
+
+    def cached(self, query: str, model: str = DEFAULT_MODEL) -> Optional[Dict[str, Any]]:
+        """A fresh cached answer without calling upstream, or None"""
+        return self.cache.get(query, model)
+
+    async def chat_completion(self, query: str, model: str = DEFAULT_MODEL,
+                              use_cache: bool = True) -> Dict[str, Any]:
+        """Make a chat completion request to Grok API (answers are cached for GROK_CACHE_TTL)"""
+        if use_cache:
+            return await self.cache.fetch(query, model, lambda: self._complete(query, model))
+        return await self._complete(query, model)
+
+    async def _complete(self, query: str, model: str) -> Dict[str, Any]:
+
         payload = {
             'model': model,
             'messages': [
@@ -37,35 +245,77 @@ class GrokAPI:
             'stream': False,
             'temperature': 0
         }
-        
-        url = f"{self.base_url}/chat/completions"
-        
-        # Create SSL context that bypasses certificate verification
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        
-        async with aiohttp.ClientSession(connector=connector) as session:
-            try:
-                async with session.post(url, headers=headers, json=payload) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return {
-                            'success': True,
-                            'content': data['choices'][0]['message']['content'],
-                            'usage': data.get('usage', {}),
-                            'model': data.get('model')
-                        }
-                    else:
-                        error_text = await response.text()
-                        return {
-                            'success': False,
-                            'error': f'Status {response.status}: {error_text}'
-                        }
-            except Exception as e:
+
+        body = json.dumps(payload).encode()
+        self.last_request_at = time.monotonic()
+
+        # Fail over to a different backend on 429, 5xx or connection errors
+        tried = set()
+        result = {'success': False, 'error': 'No upstream backends configured'}
+        overloaded = False
+        await self.limiter.acquire()
+        started = time.monotonic()
+        latency = None
+        try:
+            for attempt in range(self.retries + 1):
+                backend = self.pool.pick(exclude=tried)
+                if backend is None:
+                    break
+                tried.add(backend)
+                result, retryable = await self._post(backend, body)
+                # Any 429, 5xx or connection error tells the limiter upstream is saturated
+                overloaded = overloaded or retryable
+                if result['success'] or not retryable:
+                    break
+            latency = time.monotonic() - started
+        finally:
+            self.limiter.release(latency, overloaded)
+        return result
+
+    async def _post(self, backend: UpstreamBackend, body: bytes) -> Tuple[Dict[str, Any], bool]:
+        """One attempt against one backend; returns the result and whether to retry elsewhere"""
+        headers = {
+            'Authorization': f'Bearer {backend.api_key}',
+            'Content-Type': 'application/json'
+        }
+        url = f"{backend.base_url}/chat/completions"
+
+        backend.outstanding += 1
+        backend.requests += 1
+        started = time.monotonic()
+        try:
+            response = await self.transport.request('POST', url, headers, body)
+            if response.status == 200:
+                with span('upstream.decode', bytes=len(response.body)):
+                    data = await offload.decode(response.body, 'upstream')
+                usage = data.get('usage', {})
+                latency = time.monotonic() - started
+                backend.record_success(latency, usage)
+                return {
+                    'success': True,
+                    'content': data['choices'][0]['message']['content'],
+                    'usage': usage,
+                    'model': data.get('model'),
+                    'backend': backend.name,
+                    'latency_ms': round(latency * 1000, 1)
+                }, False
+            else:
+                error = f'Status {response.status}: {response.text()}'
+                retryable = response.status == 429 or response.status >= 500
+                if retryable:
+                    cooldown = self.pool.cooldown
+                    if response.status == 429 and response.headers.get('Retry-After', '').isdigit():
+                        cooldown = max(cooldown, float(response.headers['Retry-After']))
+                    backend.record_failure(error, self.pool.max_failures, cooldown)
                 return {
                     'success': False,
-                    'error': str(e)
-                }
+                    'error': error
+                }, retryable
+        except Exception as e:
+            backend.record_failure(str(e), self.pool.max_failures, self.pool.cooldown)
+            return {
+                'success': False,
+                'error': str(e)
+            }, True
+        finally:
+            backend.outstanding -= 1
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Bulk query runner: evaluation sets through GrokAPI without the web server
+
+Reads queries as JSONL, CSV or plain lines from a file or stdin, runs them concurrently
+and appends one JSON result per line to the output. The output doubles as the
+checkpoint: rerunning the same command skips items that already succeeded.
+
+    python grok_bulk.py evals.jsonl -o results.jsonl --concurrency 32
+    cut -f2 questions.tsv | python grok_bulk.py - -o results.jsonl
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import time
+from typing import Dict, Any, Iterable, List, Set
+
+from grok_api import GrokAPI, DEFAULT_MODEL
+
+
+def parse_items(text: str, fmt: str, field: str, id_field: str) -> List[Dict[str, Any]]:
+    """Items as {'id', 'query'}; ids default to the 1-based row number"""
+    has_header = field in next(csv.reader(io.StringIO(text[:4096])), [])
+    if fmt == 'auto':
+        # Only a header naming the query column makes it CSV: a question may well contain commas
+        fmt = 'jsonl' if text.lstrip().startswith('{') else 'csv' if has_header else 'lines'
+    if fmt == 'jsonl':
+        rows: Iterable = (json.loads(line) for line in text.splitlines() if line.strip())
+    elif fmt == 'lines':
+        rows = ({field: line.strip()} for line in text.splitlines() if line.strip())
+    elif has_header:
+        rows = csv.DictReader(io.StringIO(text))
+    else:
+        # Headerless CSV: the first column
+        rows = ({field: row[0]} for row in csv.reader(io.StringIO(text)) if row)
+
+    items = []
+    for number, row in enumerate(rows, 1):
+        query = row.get(field)
+        if not query:
+            print(f"⚠️ Row {number}: no '{field}' field; skipped", file=sys.stderr)
+            continue
+        item_id = str(row.get(id_field) or number)
+        items.append({'id': item_id, 'query': query})
+    return items
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    """Ids already answered successfully in an earlier (possibly interrupted) run"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Torn last line from an interrupted write
+            if record.get('success'):
+                done.add(str(record['id']))
+    return done
+
+
+class Progress:
+    """One-line live progress on stderr: count, throughput, tokens, ETA"""
+
+    def __init__(self, total: int, skipped: int, interval: float = 1.0):
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_print = 0.0
+        self.done = 0
+        self.errors = 0
+        self.cached = 0
+        self.tokens = 0
+
+    def record(self, result: Dict[str, Any]):
+        self.done += 1
+        if not result.get('success'):
+            self.errors += 1
+        elif result.get('cached'):
+            self.cached += 1
+        else:
+            self.tokens += (result.get('usage') or {}).get('total_tokens', 0)
+        if time.monotonic() - self.last_print >= self.interval:
+            self.show()
+
+    def show(self, end: str = ''):
+        self.last_print = time.monotonic()
+        elapsed = max(self.last_print - self.started, 1e-9)
+        rate = self.done / elapsed
+        remaining = self.total - self.done
+        eta = remaining / rate if rate else float('inf')
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta != float('inf') else '--:--:--'
+        print(f"\r[{self.done + self.skipped}/{self.total + self.skipped}] "
+              f"{rate:6.1f} q/s  {self.tokens / elapsed:8.0f} tok/s  "
+              f"errors {self.errors}  cached {self.cached}  ETA {eta_text}",
+              end=end, file=sys.stderr, flush=True)
+
+
+async def run(items: List[Dict[str, Any]], output: str, concurrency: int, model: str,
+              use_cache: bool, progress: Progress):
+    grok = GrokAPI()
+    await grok.warm_up()
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    # Append-only, one line per finished item, flushed as it lands
+    out = open(output, 'a', encoding='utf-8')
+    if out.tell() > 0:
+        with open(output, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                out.write('\n')
+
+    async def worker():
+        while True:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.monotonic()
+            result = await grok.chat_completion(item['query'], model=model, use_cache=use_cache)
+            record = {
+                'id': item['id'],
+                'query': item['query'],
+                **result,
+                # End to end, including retries and waiting for a slot; the result's own is the last upstream call
+                'latency_ms': round((time.monotonic() - started) * 1000, 1)
+            }
+            if result.get('latency_ms') is not None:
+                record['upstream_latency_ms'] = result['latency_ms']
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            progress.record(result)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    finally:
+        out.close()
+        await grok.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a batch of queries through the Grok API')
+    parser.add_argument('input', help="JSONL, CSV or one-query-per-line file, or '-' for stdin")
+    parser.add_argument('-o', '--output', required=True, help='results JSONL (also the resume checkpoint)')
+    parser.add_argument('--format', choices=('auto', 'jsonl', 'csv', 'lines'), default='auto',
+                        help="auto: JSONL if lines start with '{', CSV if the first row names --field, else lines")
+    parser.add_argument('--field', default='query', help='JSON key or CSV column holding the query')
+    parser.add_argument('--id-field', default='id', help='JSON key or CSV column with a stable item id')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('GROK_UPSTREAM_CONCURRENCY', '8')))
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--no-cache', action='store_true', help='call upstream even for repeated queries')
+    args = parser.parse_args()
+
+    text = sys.stdin.read() if args.input == '-' else open(args.input, encoding='utf-8').read()
+    items = parse_items(text, args.format, args.field, args.id_field)
+    done = load_checkpoint(args.output)
+    todo = [item for item in items if item['id'] not in done]
+    print(f"📋 {len(items)} queries, {len(items) - len(todo)} already done, "
+          f"{len(todo)} to run at concurrency {args.concurrency}", file=sys.stderr)
+
+    progress = Progress(len(todo), len(items) - len(todo))
+    try:
+        asyncio.run(run(todo, args.output, args.concurrency, args.model, not args.no_cache, progress))
+    except KeyboardInterrupt:
+        progress.show(end='\n')
+        print("🔴 Interrupted; rerun the same command to resume", file=sys.stderr)
+        sys.exit(130)
+    progress.show(end='\n')
+    print(f"✅ Results in {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
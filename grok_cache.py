@@ -0,0 +1,119 @@
+"""
+Short-lived cache of upstream answers, shared by concurrent identical queries
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Any, Optional, Tuple
+
+
+class ResponseCache:
+    """TTL + LRU cache of successful completions keyed by model and query text"""
+
+    def __init__(self, ttl: float = None, capacity: int = None):
+        if ttl is None:
+            ttl = float(os.getenv('GROK_CACHE_TTL', '120'))
+        if capacity is None:
+            capacity = int(os.getenv('GROK_CACHE_SIZE', '1024'))
+        self.ttl = ttl
+        self.capacity = capacity
+        # key -> (expires_at, stored_at, result), monotonic clock
+        self.entries: 'OrderedDict[str, Tuple[float, float, Dict[str, Any]]]' = OrderedDict()
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evicted = 0
+
+    @staticmethod
+    def key(query: str, model: str) -> str:
+        return hashlib.sha256(f'{model}\x00{query}'.encode()).hexdigest()[:32]
+
+    def get(self, query: str, model: str) -> Optional[Dict[str, Any]]:
+        """A fresh cached answer, marked as such, or None"""
+        if self.ttl <= 0:
+            return None
+        key = self.key(query, model)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, stored_at, result = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(result, cached=True, age_s=round(now - stored_at, 1))
+
+    def put(self, query: str, model: str, result: Dict[str, Any]):
+        if self.ttl <= 0 or not result.get('success'):
+            return
+        now = time.monotonic()
+        key = self.key(query, model)
+        self.entries[key] = (now + self.ttl, now, result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+    def expires_in(self, query: str, model: str) -> Optional[float]:
+        """Seconds until the cached answer expires, or None if there is none"""
+        entry = self.entries.get(self.key(query, model))
+        if entry is None:
+            return None
+        return max(0.0, entry[0] - time.monotonic())
+
+    async def fetch(self, query: str, model: str,
+                    call: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Cached answer, or the result of call(); identical queries in flight share one call"""
+        cached = self.get(query, model)
+        if cached is not None:
+            return cached
+        key = self.key(query, model)
+        pending = self.pending.get(key)
+        if pending is not None:
+            self.shared += 1
+            try:
+                result = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The caller we were sharing with went away; make the call ourselves
+                return await self.fetch(query, model, call)
+            return dict(result, cached=True) if result.get('success') else result
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            result = await call()
+            self.put(query, model, result)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't log "exception never retrieved"
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.shared + self.misses
+        return {
+            'entries': len(self.entries),
+            'capacity': self.capacity,
+            'ttl_s': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared_in_flight': self.shared,
+            'evicted': self.evicted,
+            'hit_rate': round((self.hits + self.shared) / lookups, 3) if lookups else None
+        }
@@ -0,0 +1,222 @@
+"""
+Broadcast coalescing: merge stats, timeline and answers arriving within one tick
+
+Under a burst of queries each answer used to trigger its own frame to every
+client, each repeating the full stats. Here answers queue per room and the
+stats/timeline state is only marked dirty. One flush per tick sends each
+member of a room with new answers a single frame carrying them (and the latest
+state). Clients with nothing new in their rooms get the state on its own, at
+most once per state_interval, so a query costs a frame per member of its room
+rather than per client. A room whose queued answers pass flush_bytes is
+flushed at once, so large answers are never held back.
+"""
+
+import asyncio
+import os
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Any, List, Optional, Set
+
+from aiohttp import web
+
+from grok_offload import offload
+
+
+class BroadcastCoalescer:
+    """Buffers answers per room and state changes, and sends them as one frame per client per tick"""
+
+    def __init__(self, sockets: Dict[web.WebSocketResponse, Any], rooms, events, connections,
+                 state: Callable[[], Dict[str, Any]], tick: float = None, flush_bytes: int = None,
+                 state_interval: float = None):
+        if tick is None:
+            tick = float(os.getenv('GROK_BROADCAST_TICK', '0.05'))
+        if flush_bytes is None:
+            flush_bytes = int(os.getenv('GROK_BROADCAST_FLUSH_BYTES', '16384'))
+        if state_interval is None:
+            state_interval = float(os.getenv('GROK_BROADCAST_STATE_INTERVAL', '1'))
+        self.sockets = sockets
+        self.rooms = rooms
+        self.events = events
+        self.connections = connections
+        self.state = state
+        self.tick = tick
+        self.flush_bytes = flush_bytes
+        self.state_interval = state_interval
+
+        self.state_dirty = False
+        self._state_since: Optional[float] = None
+        self.last_state = float('-inf')
+        # room -> answers waiting for the next flush and their size; senders outside the room get
+        # only their own answers
+        self.outputs: Dict[str, List[str]] = defaultdict(list)
+        self.output_bytes = 0
+        self.direct: Dict[web.WebSocketResponse, List[str]] = defaultdict(list)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = 0.0
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.flushes = 0
+        self.size_flushes = 0
+        self.items = 0
+        self.frames = 0
+        self.state_frames = 0
+        self.encodes = 0
+        self.max_delay = 0.0
+        self._first_pending: Optional[float] = None
+
+    async def mark_state(self):
+        """Stats or timeline changed; a later flush carries them"""
+        if not self.state_dirty:
+            self.state_dirty = True
+            self._state_since = time.monotonic()
+        self.items += 1
+        await self._schedule()
+
+    async def add_output(self, room: str, output: str, sender: web.WebSocketResponse = None):
+        """Queue an answer for a room; the sender gets it too, even if not a member"""
+        if self._first_pending is None:
+            self._first_pending = time.monotonic()
+        self.outputs[room].append(output)
+        self.output_bytes += len(output)
+        self.items += 1
+        if sender is not None and room not in self.rooms.rooms_of.get(sender, ()):
+            self.direct[sender].append(output)
+        if self.output_bytes >= self.flush_bytes:
+            self.size_flushes += 1
+            await self.flush()
+        else:
+            await self._schedule()
+
+    def _due(self) -> Optional[float]:
+        """When the next flush is owed: a tick after the first queued answer, state at most every state_interval"""
+        due = []
+        if self.outputs:
+            due.append(self._first_pending + self.tick)
+        if self.state_dirty:
+            due.append(max(self._state_since + self.tick, self.last_state + self.state_interval))
+        return min(due) if due else None
+
+    async def _schedule(self):
+        due = self._due()
+        if due is None:
+            return
+        now = time.monotonic()
+        if due <= now:
+            await self.flush()
+            return
+        if self._timer is not None:
+            if self._timer_at <= due:
+                return
+            self._timer.cancel()
+        self._timer_at = due
+        self._timer = asyncio.get_running_loop().call_later(due - now, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        # Kept until done so a flush cannot be garbage-collected mid-flight, and close() can cancel
+        # every one still sending
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, force: bool = False):
+        """Send queued answers; the state goes out too once its interval has passed (or when forced)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        send_state = self.state_dirty and (force or now >= self.last_state + self.state_interval)
+        if not (self.outputs or send_state):
+            await self._schedule()
+            return
+        if self._first_pending is not None:
+            self.max_delay = max(self.max_delay, now - self._first_pending)
+            self._first_pending = None
+        # Take everything pending; anything arriving while we send goes into the next flush.
+        # Answer frames carry the latest state even when it is not yet due for everyone else.
+        state = self.state() if self.state_dirty else None
+        outputs, direct = self.outputs, self.direct
+        self.outputs, self.direct = defaultdict(list), defaultdict(list)
+        self.output_bytes = 0
+        if send_state:
+            self.state_dirty = False
+            self.last_state = now
+        self.flushes += 1
+
+        # Which rooms' answers each client gets; clients with the same set share one frame
+        wanted: Dict[web.WebSocketResponse, List[str]] = {}
+        for room in outputs:
+            for ws in self.rooms.subscribers(room):
+                wanted.setdefault(ws, []).append(room)
+        groups: Dict[tuple, List[web.WebSocketResponse]] = defaultdict(list)
+        for ws, rooms in wanted.items():
+            if ws not in direct:
+                groups[tuple(sorted(rooms))].append(ws)
+
+        room_bytes = {room: sum(len(o) for o in items) for room, items in outputs.items()}
+        for key, members in groups.items():
+            await self._send_outputs(key, members, [], state, outputs, room_bytes)
+        # A sender outside the room gets its own answers (and its rooms') in a frame of its own
+        for ws, own in direct.items():
+            key = tuple(sorted(wanted.setdefault(ws, [])))
+            await self._send_outputs(key, [ws], own, state, outputs, room_bytes)
+
+        if send_state:
+            data = await offload.encode(state)
+            self.encodes += 1
+            self.state_frames += 1
+            await self._send([ws for ws in self.sockets if ws not in wanted], data)
+            self.events.publish(state, data)
+        # SSE viewers get each room's answers as one event, encoded once
+        for room, items in outputs.items():
+            payload = {'outputs': items}
+            self.events.publish(payload, await offload.encode(payload), room=room)
+
+        if self.state_dirty or self.outputs:
+            await self._schedule()
+
+    async def _send_outputs(self, key: tuple, members: List[web.WebSocketResponse], own: List[str],
+                            state: Optional[Dict[str, Any]], outputs: Dict[str, List[str]],
+                            room_bytes: Dict[str, int]):
+        frame = dict(state or {})
+        frame['outputs'] = [output for room in key for output in outputs[room]] + own
+        data = await offload.encode(frame)
+        self.encodes += 1
+        await self._send(members, data)
+        # Each room is charged its share of the frame, by the size of its answers in it
+        total = sum(room_bytes[room] for room in key) + sum(len(o) for o in own) or 1
+        for room in key:
+            share = len(data) * len(members) * room_bytes[room] // total
+            self.rooms.published(room, len(outputs[room]), len(members), share)
+
+    async def _send(self, members: List[web.WebSocketResponse], data: str):
+        for ws in members:
+            try:
+                await ws.send_str(data)
+                self.connections.sent(ws, len(data))
+                self.frames += 1
+            except Exception:
+                pass
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for task in list(self._tasks):
+            task.cancel()
+        self._tasks.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tick_ms': self.tick * 1000,
+            'state_interval_ms': self.state_interval * 1000,
+            'flush_bytes': self.flush_bytes,
+            'flushes': self.flushes,
+            'size_flushes': self.size_flushes,
+            'items': self.items,
+            'items_per_flush': round(self.items / self.flushes, 2) if self.flushes else 0,
+            'frames_sent': self.frames,
+            'state_frames': self.state_frames,
+            'encodes': self.encodes,
+            'max_delay_ms': round(self.max_delay * 1000, 1)
+        }
@@ -0,0 +1,249 @@
+"""
+WebSocket connection registry: limits, idle reaping and per-connection usage
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import Counter, deque
+from typing import Dict, Any, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from grok_scheduler import TokenBucket
+
+
+def _rss_bytes() -> int:
+    """Resident set size of this process (Linux; 0 elsewhere)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+class ConnectionInfo:
+    """Lifetime and traffic of one WebSocket"""
+
+    __slots__ = ('id', 'ip', 'client_id', 'transport', 'opened_at', 'last_seen',
+                 'messages_in', 'messages_out', 'bytes_in', 'bytes_out', 'close_reason')
+
+    def __init__(self, conn_id: int, ip: str, client_id: str, transport):
+        self.id = conn_id
+        self.ip = ip
+        self.client_id = client_id
+        self.transport = transport
+        self.opened_at = time.monotonic()
+        self.last_seen = self.opened_at
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.close_reason = None
+
+    def write_buffer(self) -> int:
+        """Bytes queued in the kernel-facing send buffer (a slow reader shows up here)"""
+        if self.transport is None or self.transport.is_closing():
+            return 0
+        return self.transport.get_write_buffer_size()
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'ip': self.ip,
+            'client': self.client_id,
+            'age_s': round(now - self.opened_at, 1),
+            'idle_s': round(now - self.last_seen, 1),
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'write_buffer': self.write_buffer()
+        }
+
+
+class ConnectionRegistry:
+    """Tracks open WebSockets, enforces global and per-IP caps and reaps idle ones"""
+
+    def __init__(self, max_connections: int = None, max_per_ip: int = None,
+                 idle_timeout: float = None):
+        if max_connections is None:
+            max_connections = int(os.getenv('GROK_WS_MAX_CONNECTIONS', '10000'))
+        if max_per_ip is None:
+            max_per_ip = int(os.getenv('GROK_WS_MAX_PER_IP', '32'))
+        if idle_timeout is None:
+            idle_timeout = float(os.getenv('GROK_WS_IDLE_TIMEOUT', '1800'))
+        self.max_connections = max_connections
+        self.max_per_ip = max_per_ip
+        self.idle_timeout = idle_timeout
+        self.heartbeat = float(os.getenv('GROK_WS_HEARTBEAT', '30')) or None
+        self.max_message = int(os.getenv('GROK_WS_MAX_MESSAGE', '65536'))
+
+        # Accept pacing, so a reconnect storm is spread out instead of served at once
+        accept_rate = float(os.getenv('GROK_WS_ACCEPT_RATE', '50'))
+        self.accepts = TokenBucket(accept_rate * 60, burst=int(os.getenv('GROK_WS_ACCEPT_BURST', '100')))
+        self.accept_max_wait = float(os.getenv('GROK_WS_ACCEPT_MAX_WAIT', '2'))
+        self.paced = 0
+
+        # Broadcast iterates this mapping directly
+        self.sockets: Dict[web.WebSocketResponse, ConnectionInfo] = {}
+        self.per_ip: Counter = Counter()
+        # Admitted upgrades not yet registered (e.g. held by accept pacing); they count against the caps
+        self.pending_per_ip: Counter = Counter()
+        self.pending = 0
+        self.next_id = 0
+        self.accepted = 0
+        self.rejected: Counter = Counter()
+        self.closed: Counter = Counter()
+        self.lifetimes = deque(maxlen=1024)
+        # Process size with no connections open, to estimate the per-connection cost
+        self.baseline_rss = _rss_bytes()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def response(self) -> web.WebSocketResponse:
+        """WebSocketResponse with the configured heartbeat and message size limit"""
+        return web.WebSocketResponse(heartbeat=self.heartbeat, max_msg_size=self.max_message)
+
+    def admit(self, ip: str) -> Optional[str]:
+        """Why a new connection from ip must be refused, or None after reserving it a slot
+
+        The slot is held until add() takes it over or release() gives it back.
+        """
+        if len(self.sockets) + self.pending >= self.max_connections:
+            reason = 'max_connections'
+        elif self.max_per_ip and self.per_ip[ip] + self.pending_per_ip[ip] >= self.max_per_ip:
+            reason = 'max_per_ip'
+        else:
+            self.pending += 1
+            self.pending_per_ip[ip] += 1
+            return None
+        self.rejected[reason] += 1
+        return reason
+
+    def release(self, ip: str):
+        """Give back a slot reserved by admit()"""
+        self.pending -= 1
+        self.pending_per_ip[ip] -= 1
+        if self.pending_per_ip[ip] <= 0:
+            del self.pending_per_ip[ip]
+
+    def pace(self) -> Tuple[bool, float]:
+        """Whether to accept now-ish, and the seconds to hold the upgrade (or the retry hint if not)"""
+        ok, wait = self.accepts.reserve(1, self.accept_max_wait)
+        if not ok:
+            self.rejected['paced'] += 1
+            # Spread the retries over the backlog instead of pointing everyone at one instant
+            return False, wait * (1 + random.random())
+        if wait > 0:
+            self.paced += 1
+        return True, wait
+
+    def add(self, ws: web.WebSocketResponse, request: web.Request, client_id: str) -> ConnectionInfo:
+        """Register an upgraded socket, taking over the slot admit() reserved"""
+        self.release(request.remote)
+        if not self.sockets:
+            self.baseline_rss = _rss_bytes()
+        self.next_id += 1
+        self.accepted += 1
+        info = ConnectionInfo(self.next_id, request.remote, client_id, request.transport)
+        self.sockets[ws] = info
+        self.per_ip[info.ip] += 1
+        if self._reaper is None and self.idle_timeout > 0:
+            self._reaper = asyncio.create_task(self._reap_loop())
+        return info
+
+    def remove(self, ws: web.WebSocketResponse):
+        info = self.sockets.pop(ws, None)
+        if info is None:
+            return
+        self.per_ip[info.ip] -= 1
+        if self.per_ip[info.ip] <= 0:
+            del self.per_ip[info.ip]
+        self.lifetimes.append(time.monotonic() - info.opened_at)
+        self.closed[info.close_reason or self._close_reason(ws)] += 1
+
+    def errored(self, ws: web.WebSocketResponse, error: BaseException):
+        """Remember why aiohttp failed the connection (the close handshake can mask it)"""
+        info = self.sockets.get(ws)
+        if info is not None and info.close_reason is None:
+            code = getattr(error, 'code', None)
+            info.close_reason = 'message_too_big' if code == aiohttp.WSCloseCode.MESSAGE_TOO_BIG else 'error'
+
+    @staticmethod
+    def _close_reason(ws: web.WebSocketResponse) -> str:
+        code = ws.close_code
+        if code == aiohttp.WSCloseCode.MESSAGE_TOO_BIG:
+            return 'message_too_big'
+        if code == aiohttp.WSCloseCode.ABNORMAL_CLOSURE:
+            # aiohttp closes with 1006 when a ping goes unanswered
+            return 'heartbeat'
+        if code == aiohttp.WSCloseCode.SERVICE_RESTART:
+            return 'restart'
+        return 'client'
+
+    def received(self, ws: web.WebSocketResponse, size: int):
+        info = self.sockets.get(ws)
+        if info is not None:
+            info.last_seen = time.monotonic()
+            info.messages_in += 1
+            info.bytes_in += size
+
+    def sent(self, ws: web.WebSocketResponse, size: int):
+        info = self.sockets.get(ws)
+        if info is not None:
+            info.messages_out += 1
+            info.bytes_out += size
+
+    async def _reap_loop(self):
+        """Close connections that have sent nothing (not even a query) for idle_timeout"""
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_timeout / 4))
+            cutoff = time.monotonic() - self.idle_timeout
+            idle = [ws for ws, info in self.sockets.items() if info.last_seen < cutoff]
+            for ws in idle:
+                self.sockets[ws].close_reason = 'idle'
+            # Each close waits for the peer's reply; don't let one slow peer hold up the rest
+            await asyncio.gather(*(ws.close(code=aiohttp.WSCloseCode.GOING_AWAY, message=b'idle timeout')
+                                   for ws in idle), return_exceptions=True)
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+    def stats(self, limit: int = 50) -> Dict[str, Any]:
+        now = time.monotonic()
+        rss = _rss_bytes()
+        lifetimes = sorted(self.lifetimes)
+        infos: List[ConnectionInfo] = sorted(self.sockets.values(), key=lambda i: i.opened_at)
+        return {
+            'open': len(self.sockets),
+            'pending': self.pending,
+            'max_connections': self.max_connections,
+            'max_per_ip': self.max_per_ip,
+            'heartbeat_s': self.heartbeat,
+            'idle_timeout_s': self.idle_timeout,
+            'max_message_bytes': self.max_message,
+            'accepted': self.accepted,
+            'accept_rate_per_s': self.accepts.rate,
+            'paced': self.paced,
+            'rejected': dict(self.rejected),
+            'closed': dict(self.closed),
+            'top_ips': dict(self.per_ip.most_common(10)),
+            'memory': {
+                'rss_bytes': rss,
+                'baseline_rss_bytes': self.baseline_rss,
+                # Rough sizing figure: growth since the last idle moment, shared out
+                'per_connection_bytes': (rss - self.baseline_rss) // len(self.sockets) if self.sockets else 0,
+                'write_buffers_bytes': sum(i.write_buffer() for i in infos)
+            },
+            'lifetime_s': {
+                'count': len(lifetimes),
+                'p50': round(lifetimes[len(lifetimes) // 2], 1) if lifetimes else 0,
+                'p95': round(lifetimes[int(len(lifetimes) * 0.95)], 1) if lifetimes else 0,
+                'max': round(lifetimes[-1], 1) if lifetimes else 0
+            },
+            'connections': [i.stats(now) for i in infos[:limit]]
+        }
@@ -0,0 +1,100 @@
+"""
+Shared broadcast feed for WebSocket clients and Server-Sent Events viewers
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class Event:
+    """One broadcast, serialized once and shared by every transport"""
+
+    __slots__ = ('seq', 'id', 'data', 'sse', 'room')
+
+    def __init__(self, seq: int, event_id: str, data: str, room: Optional[str] = None):
+        self.seq = seq
+        self.id = event_id
+        self.data = data
+        # None for frames every viewer gets
+        self.room = room
+        self.sse = f'id: {event_id}\ndata: {data}\n\n'.encode()
+
+
+class EventHub:
+    """Numbers broadcasts, keeps a replay window and fans frames out to SSE subscribers"""
+
+    def __init__(self, replay: int = None, queue_size: int = None):
+        if replay is None:
+            replay = int(os.getenv('GROK_EVENT_REPLAY', '256'))
+        if queue_size is None:
+            queue_size = int(os.getenv('GROK_SSE_QUEUE', '64'))
+        # Event ids carry a boot epoch so ids from a previous process never match
+        self.epoch = str(int(time.time()))
+        self.seq = 0
+        self.history = deque(maxlen=replay)
+        self.queue_size = queue_size
+        self.subscribers = set()
+        self.dropped = 0
+
+    def publish(self, payload: Dict[str, Any], data: str = None, room: str = None) -> Event:
+        """data is the payload already serialized, when the caller encoded it off the loop"""
+        self.seq += 1
+        if data is None:
+            data = json.dumps(payload)
+        event = Event(self.seq, f'{self.epoch}:{self.seq}', data, room)
+        self.history.append(event)
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow viewer: cut it loose, it resumes from Last-Event-ID
+                self.dropped += 1
+                self._cut(queue)
+        return event
+
+    def _cut(self, queue: asyncio.Queue):
+        """End a subscription: the None sentinel tells the handler to close the stream"""
+        self.subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def close_all(self):
+        """End every subscription, e.g. before handing over to a new process"""
+        for queue in list(self.subscribers):
+            self._cut(queue)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def since(self, last_event_id: Optional[str]) -> Tuple[bool, List[Event]]:
+        """Events after last_event_id, and whether the gap could be replayed in full"""
+        if not last_event_id:
+            return False, []
+        epoch, _, seq = last_event_id.partition(':')
+        if epoch != self.epoch or not seq.isdigit():
+            return False, []
+        seq = int(seq)
+        if seq > self.seq:
+            return False, []
+        oldest = self.history[0].seq if self.history else self.seq + 1
+        if seq + 1 < oldest:
+            return False, []
+        return True, [event for event in self.history if event.seq > seq]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'last_event_id': f'{self.epoch}:{self.seq}',
+            'replay_window': len(self.history),
+            'sse_subscribers': len(self.subscribers),
+            'sse_dropped': self.dropped
+        }
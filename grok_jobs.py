@@ -0,0 +1,272 @@
+"""
+Durable asynchronous jobs: a SQLite-backed queue drained by a bounded worker pool
+
+Callers submit a query and get an id back at once, then poll (or long-poll)
+for the result. Jobs survive restarts: a job claimed by a process that has
+since exited goes back to the queue, and finished results are kept for a TTL.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+
+from grok_log import log, new_request_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    query TEXT NOT NULL,
+    client TEXT NOT NULL,
+    created REAL NOT NULL,
+    not_before REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, not_before, created);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished);
+"""
+
+FINISHED = ('done', 'failed')
+
+
+class QueueFull(Exception):
+    """Raised when too many jobs are already waiting"""
+
+    def __init__(self, queued: int, retry_after: int):
+        super().__init__(f'{queued} jobs queued')
+        self.queued = queued
+        self.retry_after = retry_after
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue:
+    """All SQLite access runs on one dedicated thread, so the event loop never waits on disk"""
+
+    def __init__(self, runner: Callable[[str, str], Awaitable[Dict[str, Any]]], path: str = None,
+                 workers: int = None, ttl: float = None):
+        if path is None:
+            path = os.getenv('GROK_JOBS_DB', 'grok_jobs.db')
+        if workers is None:
+            workers = int(os.getenv('GROK_JOBS_WORKERS', '4'))
+        if ttl is None:
+            ttl = float(os.getenv('GROK_JOBS_TTL', '86400'))
+        self.runner = runner
+        self.path = path
+        self.workers = workers
+        self.ttl = ttl
+        self.max_queued = int(os.getenv('GROK_JOBS_MAX_QUEUED', '10000'))
+        self.max_attempts = int(os.getenv('GROK_JOBS_MAX_ATTEMPTS', '5'))
+        self.max_wait = float(os.getenv('GROK_JOBS_MAX_WAIT', '60'))
+        self.poll_interval = float(os.getenv('GROK_JOBS_POLL_INTERVAL', '1'))
+
+        self.pid = os.getpid()
+        self.db: Optional[sqlite3.Connection] = None
+        self.io = ThreadPoolExecutor(1, thread_name_prefix='grok-jobs-db')
+        self.wakeup = asyncio.Event()
+        # job id -> events of long-poll waiters, set when this process finishes the job
+        self.waiters: Dict[str, List[asyncio.Event]] = {}
+        self.tasks = []
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.recovered = 0
+
+    async def _call(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io, fn, *args)
+
+    def _open(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        # WAL lets a successor process read and claim while we are still draining
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('PRAGMA busy_timeout=5000')
+        self.db.executescript(SCHEMA)
+
+    async def start(self):
+        if self.db is not None:
+            return
+        # Opened even without workers: this process still accepts jobs and answers polls
+        await self._call(self._open)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.tasks.append(asyncio.create_task(self._sweeper()))
+
+    async def stop(self):
+        """Stop claiming new jobs; running ones finish (drain waits for them)"""
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def close(self):
+        self.io.shutdown(wait=True)
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def _insert(self, job_id: str, query: str, client: str, now: float) -> int:
+        queued = self.db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= self.max_queued:
+            return queued
+        self.db.execute('INSERT INTO jobs (id, status, query, client, created, not_before) '
+                        "VALUES (?, 'queued', ?, ?, ?, ?)", (job_id, query, client, now, now))
+        return -1
+
+    async def submit(self, query: str, client: str) -> Dict[str, Any]:
+        job_id = uuid.uuid4().hex
+        queued = await self._call(self._insert, job_id, query, client, time.time())
+        if queued >= 0:
+            raise QueueFull(queued, retry_after=30)
+        self.wakeup.set()
+        return {'id': job_id, 'status': 'queued'}
+
+    def _get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {'id': row['id'], 'status': row['status'], 'created': row['created'],
+               'started': row['started'], 'finished': row['finished'], 'attempts': row['attempts']}
+        if row['status'] == 'queued':
+            job['position'] = self.db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?", (row['created'],)).fetchone()[0]
+        if row['status'] in FINISHED:
+            job['expires_at'] = row['finished'] + self.ttl
+            job['result'] = json.loads(row['result']) if row['result'] else None
+            job['error'] = row['error']
+        return job
+
+    async def get(self, job_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """The job, waiting up to wait seconds for it to finish"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(wait, self.max_wait)
+        event = asyncio.Event()
+        waiters = self.waiters.setdefault(job_id, [])
+        waiters.append(event)
+        try:
+            while True:
+                job = await self._call(self._get, job_id)
+                remaining = deadline - loop.time()
+                if job is None or job['status'] in FINISHED or remaining <= 0:
+                    return job
+                try:
+                    # Woken at once if we run it; polled in case another process does
+                    await asyncio.wait_for(event.wait(), min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters.remove(event)
+            if not waiters:
+                self.waiters.pop(job_id, None)
+
+    def _claim(self, now: float) -> Optional[sqlite3.Row]:
+        return self.db.execute(
+            "UPDATE jobs SET status = 'running', owner = ?, started = ?, attempts = attempts + 1 "
+            "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND not_before <= ? "
+            "ORDER BY created LIMIT 1) RETURNING id, query, client, attempts",
+            (self.pid, now, now)).fetchone()
+
+    def _finish(self, job_id: str, status: str, result: Optional[str], error: Optional[str]):
+        self.db.execute('UPDATE jobs SET status = ?, finished = ?, result = ?, error = ?, owner = NULL '
+                        'WHERE id = ?', (status, time.time(), result, error, job_id))
+
+    def _requeue(self, job_id: str, not_before: float):
+        self.db.execute("UPDATE jobs SET status = 'queued', not_before = ?, owner = NULL WHERE id = ?",
+                        (not_before, job_id))
+
+    async def _worker(self):
+        while True:
+            job = await self._call(self._claim, time.time())
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # Once claimed the job runs to completion, even if stop() cancels this worker
+            await asyncio.shield(self._run(job))
+
+    async def _run(self, job: sqlite3.Row):
+        new_request_id()
+        started = time.monotonic()
+        self.running += 1
+        try:
+            result = await self.runner(job['query'], job['client'])
+        except Exception as e:
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is not None and job['attempts'] < self.max_attempts:
+                # Shed or over quota: try again later rather than failing the job
+                self.retried += 1
+                await self._call(self._requeue, job['id'], time.time() + retry_after)
+                return
+            result = {'success': False, 'error': str(e)}
+        finally:
+            self.running -= 1
+        status = 'done' if result.get('success') else 'failed'
+        if status == 'done':
+            self.completed += 1
+            log.info('job.done', job=job['id'], client=job['client'], attempts=job['attempts'],
+                     duration_ms=round((time.monotonic() - started) * 1000, 1))
+        else:
+            self.failed += 1
+            log.warning('job.failed', job=job['id'], client=job['client'], error=str(result.get('error'))[:500])
+        await self._call(self._finish, job['id'], status, json.dumps(result), result.get('error'))
+        for event in self.waiters.get(job['id'], ()):
+            event.set()
+
+    def _sweep(self, now: float) -> int:
+        """Drop expired results and requeue jobs whose process died mid-run"""
+        placeholders = ','.join('?' * len(FINISHED))
+        self.db.execute(f'DELETE FROM jobs WHERE status IN ({placeholders}) AND finished < ?',
+                        (*FINISHED, now - self.ttl))
+        orphans = [row['id'] for row in self.db.execute(
+            "SELECT id, owner FROM jobs WHERE status = 'running' AND owner != ?", (self.pid,))
+            if not _alive(row['owner'])]
+        for job_id in orphans:
+            self._requeue(job_id, now)
+        return len(orphans)
+
+    async def _sweeper(self):
+        while True:
+            recovered = await self._call(self._sweep, time.time())
+            if recovered:
+                self.recovered += recovered
+                log.info('jobs.recovered', jobs=recovered)
+                self.wakeup.set()
+            await asyncio.sleep(60)
+
+    def _counts(self) -> Dict[str, int]:
+        return {row[0]: row[1] for row in self.db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')}
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            'db': self.path,
+            'workers': self.workers,
+            'running_here': self.running,
+            'by_status': await self._call(self._counts) if self.db is not None else {},
+            'completed': self.completed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'recovered': self.recovered,
+            'ttl_s': self.ttl,
+            'long_poll_waiters': sum(len(w) for w in self.waiters.values())
+        }
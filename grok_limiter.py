@@ -0,0 +1,148 @@
+"""
+Adaptive upstream concurrency: the in-flight limit follows observed latency and errors
+
+The gradient algorithm compares a baseline latency (the best recently seen)
+with recent latency. While they agree the limit grows by about its square root
+per sample; when recent latency rises above the baseline (a queue is forming
+upstream) the limit shrinks in proportion. Overload errors (429, 5xx, timeouts) cut it
+multiplicatively. AIMD (add one per saturated success, back off on errors) and
+a fixed limit are available as alternatives.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Any, Optional
+
+
+class AdaptiveLimiter:
+    """Caps calls in flight at an adaptive limit; acquire() waits for a slot"""
+
+    def __init__(self, initial: int = None, min_limit: int = None, max_limit: int = None,
+                 algorithm: str = None):
+        if initial is None:
+            initial = int(os.getenv('GROK_UPSTREAM_CONCURRENCY', '8'))
+        if min_limit is None:
+            min_limit = int(os.getenv('GROK_LIMIT_MIN', '1'))
+        if max_limit is None:
+            max_limit = int(os.getenv('GROK_LIMIT_MAX', '64'))
+        if algorithm is None:
+            algorithm = os.getenv('GROK_LIMIT_ALGORITHM', 'gradient')
+        self.algorithm = algorithm
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.estimate = float(min(max(initial, min_limit), self.max_limit))
+        self.backoff = float(os.getenv('GROK_LIMIT_BACKOFF', '0.75'))
+        # Calls slower than this count as overload even if they succeed
+        self.timeout = float(os.getenv('GROK_LIMIT_TIMEOUT', '30'))
+        self.smoothing = 0.2
+        # Latency baseline (the best seen, drifting up slowly) and recent latency (fast EWMA)
+        self.long_rtt: Optional[float] = None
+        self.short_rtt: Optional[float] = None
+        self.gradient = 1.0
+
+        self.inflight = 0
+        self.waiters: deque = deque()
+        self.samples = 0
+        self.drops = 0
+        self.max_waiters = 0
+        self.history = deque(maxlen=int(os.getenv('GROK_LIMIT_HISTORY', '200')))
+        self.history.append((time.time(), self.limit, 'start'))
+
+    @property
+    def limit(self) -> int:
+        return int(self.estimate)
+
+    async def acquire(self):
+        if self.inflight < self.limit and not self.waiters:
+            self.inflight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.max_waiters = max(self.max_waiters, len(self.waiters))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self.inflight -= 1
+                self._wake()
+            else:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self, latency: Optional[float], dropped: bool = False):
+        """Free a slot; latency None (e.g. cancelled call) frees it without a sample"""
+        inflight = self.inflight
+        self.inflight -= 1
+        if latency is not None:
+            self.sample(latency, dropped or latency >= self.timeout, inflight)
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self.inflight < self.limit:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+    def sample(self, latency: float, dropped: bool, inflight: int):
+        """Adjust the limit after one call that ran with inflight calls outstanding"""
+        self.samples += 1
+        before = self.limit
+        if dropped:
+            self.drops += 1
+            if self.algorithm != 'fixed':
+                self.estimate = max(self.min_limit, self.estimate * self.backoff)
+            reason = 'overload'
+        elif self.algorithm == 'aimd':
+            # Only grow when the limit was actually the constraint
+            if inflight * 2 >= self.estimate:
+                self.estimate = min(self.max_limit, self.estimate + 1)
+            reason = 'aimd'
+        elif self.algorithm == 'gradient':
+            self._gradient(latency, inflight)
+            reason = 'latency'
+        else:
+            reason = 'fixed'
+        if self.limit != before:
+            self.history.append((time.time(), self.limit, reason))
+
+    def _gradient(self, latency: float, inflight: int):
+        if self.long_rtt is None:
+            self.long_rtt = self.short_rtt = latency
+            return
+        self.short_rtt = 0.7 * self.short_rtt + 0.3 * latency
+        if latency < self.long_rtt:
+            self.long_rtt = latency
+        else:
+            # A baseline that followed recent latency would creep up with the queue it should detect;
+            # drifting up this slowly only accepts an upstream that has become slower for good
+            self.long_rtt = 0.998 * self.long_rtt + 0.002 * latency
+        self.gradient = max(0.5, min(1.0, self.long_rtt / self.short_rtt))
+        if inflight * 2 < self.estimate and self.gradient >= 1.0:
+            # App-limited: not enough demand to learn whether a higher limit would help
+            return
+        target = self.estimate * self.gradient + math.sqrt(self.estimate)
+        target = min(self.max_limit, max(self.min_limit, target))
+        self.estimate = (1 - self.smoothing) * self.estimate + self.smoothing * target
+
+    def stats(self, history: int = 50) -> Dict[str, Any]:
+        return {
+            'algorithm': self.algorithm,
+            'limit': self.limit,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'inflight': self.inflight,
+            'waiting': len(self.waiters),
+            'max_waiting': self.max_waiters,
+            'samples': self.samples,
+            'drops': self.drops,
+            'rtt_baseline_ms': round(self.long_rtt * 1000, 1) if self.long_rtt else None,
+            'rtt_recent_ms': round(self.short_rtt * 1000, 1) if self.short_rtt else None,
+            'gradient': round(self.gradient, 3),
+            'history': [{'at': round(at, 3), 'limit': limit, 'reason': reason}
+                        for at, limit, reason in list(self.history)[-history:]]
+        }
@@ -0,0 +1,175 @@
+"""
+Structured logging that never blocks the event loop
+
+Records are appended to a deque as plain dicts; a background thread wakes
+every flush interval (or once a batch is full), serializes them to JSON lines
+and writes each batch with a single call. Repeated warnings and errors are rate
+limited per (event, error) so an outage cannot flood the log.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Any, Optional, Tuple
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+# Set per WebSocket message or REST request; stamped on every record logged meanwhile
+request_id: ContextVar[Optional[str]] = ContextVar('request_id', default=None)
+
+
+def new_request_id() -> str:
+    rid = uuid.uuid4().hex[:12]
+    request_id.set(rid)
+    return rid
+
+
+class StructuredLogger:
+    """Buffer + background writer; the caller only builds a dict and appends it"""
+
+    def __init__(self, path: str = None, level: str = None, fmt: str = None, queue_size: int = None):
+        if path is None:
+            path = os.getenv('GROK_LOG_FILE', '')
+        if level is None:
+            level = os.getenv('GROK_LOG_LEVEL', 'info')
+        if fmt is None:
+            fmt = os.getenv('GROK_LOG_FORMAT', 'json')
+        if queue_size is None:
+            queue_size = int(os.getenv('GROK_LOG_QUEUE', '10000'))
+        self.path = path
+        self.level = LEVELS.get(level.lower(), 20)
+        self.fmt = fmt
+        self.batch_size = int(os.getenv('GROK_LOG_BATCH', '256'))
+        self.flush_interval = float(os.getenv('GROK_LOG_FLUSH_INTERVAL', '0.5'))
+        self.repeat_window = float(os.getenv('GROK_LOG_REPEAT_WINDOW', '60'))
+        self.repeat_burst = int(os.getenv('GROK_LOG_REPEAT_BURST', '5'))
+
+        self.queue_size = queue_size
+        # deque.append/popleft are atomic, so the hot path takes no lock
+        self.buffer: deque = deque()
+        self.wakeup = threading.Event()
+        self.closing = False
+        # (event, error) -> [window start, seen in window, suppressed in window]
+        self.repeats: Dict[Tuple[str, str], list] = {}
+        self.written = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self.batches = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_writer(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='grok-log-writer', daemon=True)
+                    self._thread.start()
+                    atexit.register(self.close)
+
+    def _throttle(self, event: str, fields: Dict[str, Any]) -> Optional[int]:
+        """None to drop this record; otherwise how many like it were suppressed before it"""
+        key = (event, str(fields.get('error', ''))[:200])
+        now = time.monotonic()
+        state = self.repeats.get(key)
+        if state is None or now - state[0] >= self.repeat_window:
+            suppressed = state[2] if state else 0
+            self.repeats[key] = [now, 1, 0]
+            if len(self.repeats) > 4096:
+                self.repeats.clear()
+            return suppressed
+        state[1] += 1
+        if state[1] > self.repeat_burst:
+            state[2] += 1
+            self.suppressed += 1
+            return None
+        return 0
+
+    def log(self, level: str, event: str, **fields):
+        severity = LEVELS[level]
+        if severity < self.level:
+            return
+        if severity >= LEVELS['warning']:
+            suppressed = self._throttle(event, fields)
+            if suppressed is None:
+                return
+            if suppressed:
+                fields['suppressed_repeats'] = suppressed
+        record = {'ts': time.time(), 'level': level, 'event': event}
+        rid = request_id.get()
+        if rid:
+            record['request_id'] = rid
+        record.update(fields)
+        self._ensure_writer()
+        if len(self.buffer) >= self.queue_size:
+            # Never wait for the writer: losing a line beats stalling the loop
+            self.dropped += 1
+            return
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    def debug(self, event: str, **fields):
+        self.log('debug', event, **fields)
+
+    def info(self, event: str, **fields):
+        self.log('info', event, **fields)
+
+    def warning(self, event: str, **fields):
+        self.log('warning', event, **fields)
+
+    def error(self, event: str, **fields):
+        self.log('error', event, **fields)
+
+    def _format(self, record: Dict[str, Any]) -> str:
+        stamp = datetime.fromtimestamp(record['ts'], timezone.utc)
+        if self.fmt == 'text':
+            extras = ' '.join(f'{k}={v}' for k, v in record.items() if k not in ('ts', 'level', 'event'))
+            return f"{stamp.astimezone().strftime('%H:%M:%S')} {record['level'].upper():<7} {record['event']} {extras}"
+        record['ts'] = stamp.isoformat(timespec='milliseconds')
+        return json.dumps(record, default=str, ensure_ascii=False)
+
+    def _run(self):
+        stream = open(self.path, 'a', encoding='utf-8', buffering=1 << 16) if self.path else sys.stdout
+        while True:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            closing = self.closing
+            while self.buffer:
+                batch = []
+                while self.buffer and len(batch) < self.batch_size:
+                    batch.append(self.buffer.popleft())
+                stream.write('\n'.join(self._format(r) for r in batch) + '\n')
+                stream.flush()
+                self.written += len(batch)
+                self.batches += 1
+            if closing:
+                break
+        if stream is not sys.stdout:
+            stream.close()
+
+    def close(self, timeout: float = 2.0):
+        """Flush what is queued and stop the writer"""
+        if self._thread is not None and self._thread.is_alive():
+            self.closing = True
+            self.wakeup.set()
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': len(self.buffer),
+            'written': self.written,
+            'batches': self.batches,
+            'dropped': self.dropped,
+            'suppressed_repeats': self.suppressed,
+            'level': next(name for name, value in LEVELS.items() if value == self.level)
+        }
+
+
+log = StructuredLogger()
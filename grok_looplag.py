@@ -0,0 +1,151 @@
+"""
+Event-loop health: scheduling-lag histogram and slow-callback attribution
+"""
+
+import asyncio
+import os
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Any, Optional
+
+from grok_log import log
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is open-ended)
+LAG_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    """Readable name for what a loop callback was running (task coroutine or function)"""
+    callback = getattr(handle, '_callback', None)
+    owner = getattr(callback, '__self__', None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        frame = getattr(coro, 'cr_frame', None)
+        where = f' (next await {frame.f_code.co_filename}:{frame.f_lineno})' if frame else ''
+        return f'task {owner.get_name()} {getattr(coro, "__qualname__", coro)}{where}'
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+def install_uvloop() -> bool:
+    """Switch to uvloop's event loop policy when GROK_UVLOOP=1 and it is installed"""
+    if os.getenv('GROK_UVLOOP', '').lower() not in ('1', 'true', 'yes'):
+        return False
+    try:
+        import uvloop
+    except ImportError:
+        log.warning('loop.uvloop_missing', error='GROK_UVLOOP=1 needs `pip install uvloop`; using asyncio')
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+class LoopMonitor:
+    """Samples how late a periodic timer fires; opt-in, times every callback the loop runs"""
+
+    def __init__(self, interval: float = None, slow_callback_ms: float = None):
+        if interval is None:
+            interval = float(os.getenv('GROK_LOOP_SAMPLE_INTERVAL', '0.1'))
+        if slow_callback_ms is None:
+            # Off by default: timing callbacks wraps the private Handle._run for the whole process
+            slow_callback_ms = float(os.getenv('GROK_SLOW_CALLBACK_MS', '0'))
+        self.interval = interval
+        self.slow_callback = slow_callback_ms / 1000
+        self.buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.slow = deque(maxlen=50)
+        self.slow_count = 0
+        self.tracking_callbacks = False
+        self._task: Optional[asyncio.Task] = None
+        self._original_run = None
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._sample_loop())
+        if self.slow_callback > 0:
+            self._patch_handles()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+            self.tracking_callbacks = False
+
+    def _patch_handles(self):
+        """Time callbacks on the pure-Python loop; uvloop's C handles cannot be wrapped"""
+        loop = asyncio.get_running_loop()
+        if not isinstance(loop, asyncio.BaseEventLoop) or self._original_run is not None:
+            return
+        original = self._original_run = asyncio.events.Handle._run
+        threshold = self.slow_callback
+        monitor = self
+        clock = time.perf_counter
+
+        def timed_run(handle):
+            started = clock()
+            original(handle)
+            elapsed = clock() - started
+            if elapsed >= threshold:
+                monitor.record_slow(handle, elapsed)
+
+        asyncio.events.Handle._run = timed_run
+        self.tracking_callbacks = True
+
+    def record_slow(self, handle: asyncio.Handle, elapsed: float):
+        self.slow_count += 1
+        callback = describe_callback(handle)
+        self.slow.append({'at': round(time.time(), 3), 'duration_ms': round(elapsed * 1000, 1),
+                          'callback': callback})
+        log.warning('loop.slow_callback', duration_ms=round(elapsed * 1000, 1), callback=callback)
+
+    def record_lag(self, lag: float):
+        lag_ms = lag * 1000
+        self.buckets[bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    async def _sample_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record_lag(max(0.0, loop.time() - expected))
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound (ms) of the bucket holding the q-th sample, capped at the observed max"""
+        if not self.samples:
+            return None
+        max_ms = round(self.max_lag * 1000, 1)
+        rank = q * self.samples
+        seen = 0
+        for bound, count in zip(LAG_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, max_ms)
+        return max_ms
+
+    def stats(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        labels = [f'<={b}ms' for b in LAG_BUCKETS_MS] + [f'>{LAG_BUCKETS_MS[-1]}ms']
+        return {
+            'loop': f'{type(loop).__module__}.{type(loop).__name__}',
+            'sample_interval_s': self.interval,
+            'samples': self.samples,
+            'lag_ms': {
+                'mean': round(self.total_lag / self.samples * 1000, 2) if self.samples else None,
+                'p50': self.percentile(0.50),
+                'p99': self.percentile(0.99),
+                'max': round(self.max_lag * 1000, 1)
+            },
+            'histogram': dict(zip(labels, self.buckets)),
+            'slow_callback_ms': self.slow_callback * 1000,
+            'tracking_callbacks': self.tracking_callbacks,
+            'slow_callbacks': self.slow_count,
+            'recent_slow': list(self.slow)
+        }
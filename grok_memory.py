@@ -0,0 +1,134 @@
+"""
+Opt-in in-process memory introspection: tracemalloc snapshots diffed over time
+"""
+
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+import types
+from typing import Dict, Any, List, Optional
+
+from grok_connections import _rss_bytes
+
+# Allocations by the profiler itself and the import machinery are noise here
+SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+]
+
+# Shared by everything; following them would measure the interpreter, not the structure
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                asyncio.AbstractEventLoop)
+
+
+def deep_size(obj, limit: int = 10000) -> int:
+    """Approximate bytes held by obj and what it references (containers and objects followed, up to limit)"""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack and len(seen) < limit:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif not isinstance(item, SHARED_TYPES):
+            # Plain objects, e.g. the scheduler's ClientState with its heap and token buckets
+            attrs = getattr(item, '__dict__', None)
+            if attrs is not None:
+                stack.append(attrs)
+            for klass in type(item).__mro__:
+                for name in getattr(klass, '__slots__', ()):
+                    if hasattr(item, name):
+                        stack.append(getattr(item, name))
+    return total
+
+
+class MemoryProfiler:
+    """Keeps a baseline and the previous snapshot so each call shows what grew since"""
+
+    def __init__(self, enabled: bool = None, frames: int = None):
+        if enabled is None:
+            enabled = os.getenv('GROK_DEBUG_MEMORY', '').lower() in ('1', 'true', 'yes')
+        if frames is None:
+            frames = int(os.getenv('GROK_TRACEMALLOC_FRAMES', '1'))
+        self.enabled = enabled
+        self.frames = frames
+        self.baseline: Optional[tracemalloc.Snapshot] = None
+        self.previous: Optional[tracemalloc.Snapshot] = None
+        self.baseline_at: Optional[float] = None
+        self.previous_at: Optional[float] = None
+
+    def start(self):
+        """Begin tracing (only when opted in: tracemalloc slows every allocation)"""
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.reset()
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.baseline = self.previous = None
+
+    def reset(self):
+        self.baseline = self.previous = self._take()
+        self.baseline_at = self.previous_at = time.time()
+
+    @staticmethod
+    def _take() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(SNAPSHOT_FILTERS)
+
+    @staticmethod
+    def _top(stats: List[tracemalloc.StatisticDiff], top: int) -> List[Dict[str, Any]]:
+        rows = []
+        for stat in stats[:top]:
+            frame = stat.traceback[0]
+            rows.append({
+                # Grouped by module, the line number is 0
+                'where': f'{frame.filename}:{frame.lineno}' if frame.lineno else frame.filename,
+                'size_bytes': stat.size,
+                'size_diff_bytes': stat.size_diff,
+                'count': stat.count,
+                'count_diff': stat.count_diff
+            })
+        return rows
+
+    def report(self, compare: str = 'previous', top: int = 25) -> Dict[str, Any]:
+        """Growth since the baseline or the previous call, by line and by module (runs off-loop)"""
+        current = self._take()
+        reference = self.baseline if compare == 'baseline' else self.previous
+        since = self.baseline_at if compare == 'baseline' else self.previous_at
+        by_line = current.compare_to(reference, 'lineno')
+        by_module = current.compare_to(reference, 'filename')
+        traced, peak = tracemalloc.get_traced_memory()
+        self.previous, self.previous_at = current, time.time()
+        return {
+            'compare': compare,
+            'since_s': round(time.time() - since, 1),
+            'traced_bytes': traced,
+            'traced_peak_bytes': peak,
+            'by_line': self._top(by_line, top),
+            'by_module': self._top(by_module, top)
+        }
+
+    @staticmethod
+    def process(objects: bool = False) -> Dict[str, Any]:
+        """objects also counts every object the GC tracks, which walks the whole heap"""
+        info = {
+            'rss_bytes': _rss_bytes(),
+            'gc_counts': gc.get_count(),
+            'tracing': tracemalloc.is_tracing()
+        }
+        if objects:
+            info['gc_objects'] = len(gc.get_objects())
+        return info
@@ -5,13 +5,35 @@ A glitchy, Matrix-style terminal interface for xAI queries
 """
 
 import asyncio
+import hashlib
+import html
 import json
 import time
+import uuid
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import sys
 import os
+import random
 from grok_api import GrokAPI
+from grok_tracing import Tracer, span
+from grok_admission import AdmissionController, AdmissionRejected
+from grok_events import EventHub
+from grok_scheduler import QueryScheduler, QuotaExceeded
+from grok_render import FragmentCache
+from grok_timeline import EventStore
+from grok_recycle import serve, notify_ready, predecessor
+from grok_connections import ConnectionRegistry
+from grok_warming import QueryWarmer
+from grok_memory import MemoryProfiler, deep_size
+from grok_looplag import LoopMonitor, install_uvloop
+from grok_log import log, new_request_id
+from grok_offload import offload
+from grok_sketch import MetricWindows
+from grok_jobs import JobQueue, QueueFull
+from grok_rooms import RoomIndex
+from grok_coalesce import BroadcastCoalescer
+from grok_search import SearchIndex
 
 # For web server
 import aiohttp
@@ -267,6 +289,7 @@ MATRIX_HTML = '''<!DOCTYPE html>
                             <span id="tools-count">1</span>
                         </div>
                     </div>
+                    <div id="quantiles-container" style="margin-top: 10px;"></div>
                 </div>
                 
                 <div class="brainwave-container">
@@ -316,23 +339,79 @@ MATRIX_HTML = '''<!DOCTYPE html>
     <script>
         // WebSocket connection for real-time updates
         let ws = null;
+        const MAX_OUTPUTS = 100;
+        let pendingQuery = null;    // resent if the connection goes away before the answer
+        let reconnectAfter = null;  // retry hint from the server (restart or accept pacing)
+        let reconnectAttempts = 0;
+        // ?room=team-a shares answers with that room only (everyone else is in the lobby)
+        const ROOM = new URLSearchParams(window.location.search).get('room') || 'lobby';
+        
+        // Exponential backoff with full jitter, so dashboards never reconnect in lockstep
+        function backoffDelay() {
+            const ceiling = Math.min(30000, 1000 * 2 ** reconnectAttempts);
+            reconnectAttempts++;
+            return Math.random() * ceiling;
+        }
         
         function connectWebSocket() {
-            ws = new WebSocket('ws://localhost:8080/ws');
+            ws = new WebSocket(`ws://localhost:8080/ws?rooms=${encodeURIComponent(ROOM)}`);
             
             ws.onopen = () => {
                 console.log('Connected to Grok Mind');
                 document.getElementById('status').textContent = 'CONNECTED';
+                if (pendingQuery) ws.send(JSON.stringify({ type: 'query', query: pendingQuery, room: ROOM }));
             };
             
             ws.onmessage = (event) => {
                 const data = JSON.parse(event.data);
+                if (data.type === 'reconnect') {
+                    // Server is restarting: move to the new process at the suggested time
+                    reconnectAfter = data.retry_after;
+                    ws.close();
+                    return;
+                }
+                reconnectAttempts = 0;  // Served: the connection is healthy again
+                if (data.output || data.outputs) pendingQuery = null;
                 updateInterface(data);
             };
             
-            ws.onclose = () => {
+            ws.onclose = (event) => {
+                document.getElementById('status').textContent = 'DISCONNECTED';
+                if (event.code === 1001 && document.hidden) {
+                    // Reaped as idle while in the background: come back when the tab is shown
+                    document.addEventListener('visibilitychange', connectWebSocket, { once: true });
+                    return;
+                }
+                const delay = reconnectAfter !== null ? reconnectAfter : backoffDelay();
+                reconnectAfter = null;
+                setTimeout(connectWebSocket, delay);
+            };
+        }
+        
+        // Visible dashboards count as active; abandoned background tabs get reaped as idle
+        setInterval(() => {
+            if (!document.hidden && ws && ws.readyState === WebSocket.OPEN) {
+                ws.send(JSON.stringify({ type: 'ping' }));
+            }
+        }, 60000);
+        
+        // Read-only viewers (?readonly) follow the Server-Sent Events feed instead
+        const READ_ONLY = new URLSearchParams(window.location.search).has('readonly');
+        
+        function connectEvents() {
+            const events = new EventSource(`/events?room=${encodeURIComponent(ROOM)}`);
+            
+            events.onopen = () => {
+                document.getElementById('status').textContent = 'CONNECTED';
+            };
+            
+            events.onmessage = (event) => {
+                updateInterface(JSON.parse(event.data));
+            };
+            
+            // EventSource reconnects by itself and resumes from the last event id
+            events.onerror = () => {
                 document.getElementById('status').textContent = 'DISCONNECTED';
-                setTimeout(connectWebSocket, 3000);
             };
         }
         
@@ -345,6 +424,10 @@ MATRIX_HTML = '''<!DOCTYPE html>
                 document.getElementById('tools-count').textContent = data.stats.tools || 1;
             }
             
+            if (data.quantiles) {
+                renderQuantiles(data.quantiles);
+            }
+            
             if (data.timeline) {
                 const timelineHtml = data.timeline.map(t => 
                     `<div style="color: #ffa500; margin: 5px 0;">
@@ -354,16 +437,34 @@ MATRIX_HTML = '''<!DOCTYPE html>
                 document.getElementById('timeline-container').innerHTML = timelineHtml;
             }
             
-            if (data.output) {
-                document.getElementById('output-content').innerHTML += 
-                    `<div style="color: #fff; margin: 10px 0;">${data.output}</div>`;
+            // Coalesced frames carry every answer from the last tick
+            const answers = data.outputs || (data.output ? [data.output] : []);
+            if (answers.length) {
+                // Append without re-parsing earlier answers, and keep only the most recent ones
+                const output = document.getElementById('output-content');
+                output.insertAdjacentHTML('beforeend', answers.map(html =>
+                    `<div style="color: #fff; margin: 10px 0;">${html}</div>`).join(''));
+                while (output.children.length > MAX_OUTPUTS) output.firstElementChild.remove();
             }
         }
         
+        const QUANTILE_LABELS = { upstream_ms: 'Upstream ms', e2e_ms: 'End-to-end ms', tokens: 'Tokens/req' };
+        
+        function renderQuantiles(q) {
+            const rows = Object.entries(QUANTILE_LABELS).filter(([key]) => q[key] && q[key].n).map(([key, label]) =>
+                `<div class="stat-item" title="${q[key].n} in the last ${Math.round(q.window_s / 60)} min, max ${q[key].max}">
+                    <span>${label}:</span>
+                    <span>p50 ${q[key].p50} · p95 ${q[key].p95} · p99 ${q[key].p99}</span>
+                </div>`
+            ).join('');
+            document.getElementById('quantiles-container').innerHTML = rows;
+        }
+        
         function executeQuery() {
             const query = document.getElementById('query-input').value;
             if (query && ws && ws.readyState === WebSocket.OPEN) {
-                ws.send(JSON.stringify({ type: 'query', query: query }));
+                ws.send(JSON.stringify({ type: 'query', query: query, room: ROOM }));
+                pendingQuery = query;
                 document.getElementById('query-input').value = '';
             }
         }
@@ -399,7 +500,11 @@ MATRIX_HTML = '''<!DOCTYPE html>
         // Initialize
         document.addEventListener('DOMContentLoaded', () => {
             createMatrixRain();
-            connectWebSocket();
+            if (READ_ONLY) {
+                connectEvents();
+            } else {
+                connectWebSocket();
+            }
         });
         
         // Enter key to execute
@@ -551,22 +656,61 @@ class GrokMindAgent:
             'cache': 3777,
             'tools': 1
         }
-        self.timeline = []
-        self.websockets = set()
+        self.timeline = EventStore()
+        self.connections = ConnectionRegistry()
+        self.websockets = self.connections.sockets
+        self.rooms = RoomIndex()
         self.grok = GrokAPI()  # Add real Grok API
+        self.scheduler = QueryScheduler(self.grok)
+        self.warmer = QueryWarmer(self.scheduler)
+        self.fragments = FragmentCache()
+        self.tracer = Tracer()
+        self.memory = MemoryProfiler()
+        self.loop_monitor = LoopMonitor()
+        # Sliding-window percentiles for the stats panel, in constant memory
+        self.quantiles = MetricWindows(('upstream_ms', 'e2e_ms', 'tokens'))
+        self.quantile_summary: Optional[Dict[str, Any]] = None
+        self.quantile_interval = float(os.getenv('GROK_QUANTILE_PUSH_INTERVAL', '5'))
+        self._quantile_task: Optional[asyncio.Task] = None
+        self.jobs = JobQueue(self.run_job)
+        # Past answers, searchable without the client's DOM
+        self.search = SearchIndex()
+        self.search.predecessor = predecessor()
+        self._search_task: Optional[asyncio.Task] = None
+        self.admission = AdmissionController()
+        self.events = EventHub()
+        self.coalescer = BroadcastCoalescer(self.websockets, self.rooms, self.events, self.connections,
+                                            self.broadcast_state)
+        self.sse_keepalive = float(os.getenv('GROK_SSE_KEEPALIVE', '15'))
+        self.ready = False
+        
+        # Graceful restart state: queries in flight and connections owing an answer
+        self.draining = False
+        self.inflight = 0
+        self.busy = set()
+        self.reconnect_spread = float(os.getenv('GROK_RECONNECT_SPREAD', '5'))
+        
+        # Initial stats + timeline frame, serialized once and shared until something changes
+        self._snapshot: Optional[str] = None
+        self._snapshot_sse: Optional[bytes] = None
         
-    async def run_grok_agent(self, query: str) -> Dict[str, Any]:
+    async def run_grok_agent(self, query: str, client_id: str = 'anonymous') -> Dict[str, Any]:
         """Run real Grok API"""
         
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        self.timeline.append({
-            'time': timestamp,
-            'tool': 'grok_chat_completion',
-            'args': f'{{"query": "{query[:30]}..."}}'
-        })
+        self.timeline.append('query', 'query', args=query[:200], client=client_id)
+        self.warmer.observe(query)
         
-        # Call real Grok API
-        result = await self.grok.chat_completion(query)
+        # Call real Grok API (smallest estimated queries first)
+        started = time.monotonic()
+        result = await self.scheduler.chat_completion(query, client_id=client_id)
+        self.timeline.append(
+            'tool_call', 'grok_chat_completion',
+            args=f'{{"query": "{query[:30]}..."}}',
+            client=client_id,
+            duration_ms=(time.monotonic() - started) * 1000,
+            tokens=(result.get('usage') or {}).get('total_tokens', 0),
+            ok=result['success']
+        )
         
         if result['success']:
             # Update stats with real token usage
@@ -575,73 +719,611 @@ class GrokMindAgent:
                 self.stats['prompt'] = usage.get('prompt_tokens', self.stats['prompt'])
                 self.stats['output'] = usage.get('completion_tokens', self.stats['output'])
             self.stats['tools'] += 1
+            if not result.get('cached'):
+                # Cached answers cost no upstream time or tokens
+                if result.get('latency_ms') is not None:
+                    self.quantiles.record('upstream_ms', result['latency_ms'])
+                self.quantiles.record('tokens', usage.get('total_tokens', 0))
+                self.search.add(query, result['content'], client_id)
             
-            # Format response
-            response = f"""<div style='color: #0f0; font-weight: bold;'>Grok Response:</div>
-<div style='color: #fff; margin: 10px 0;'>{result['content']}</div>
-<div style='color: #888; font-size: 12px;'>Model: {result.get('model', 'grok-beta')}</div>"""
+            # Format response (Markdown rendered once per distinct answer)
+            with span('format.html', chars=len(result['content'])):
+                content_html = await self.fragments.render(result['content'])
+                model = html.escape(result.get('model') or 'grok-beta')
+                if result.get('cached'):
+                    model += ' · cached'
+                response = f"""<div style='color: #0f0; font-weight: bold;'>Grok Response:</div>
+<div style='color: #fff; margin: 10px 0;'>{content_html}</div>
+<div style='color: #888; font-size: 12px;'>Model: {model}</div>"""
         else:
-            response = f"""<div style='color: #ff0000;'>❌ Error: {result['error']}</div>"""
+            log.warning('upstream.error', client=client_id, error=result['error'][:500])
+            response = f"""<div style='color: #ff0000;'>❌ Error: {html.escape(result['error'])}</div>"""
         
+        self._snapshot = None
+        await self.coalescer.mark_state()
         return {
             'stats': self.stats,
-            'timeline': self.timeline[-5:],
+            'timeline': self.timeline.tail(5),
             'output': response
         }
     
+    def snapshot(self) -> str:
+        """Frame sent to every new viewer; rebuilt only after a query changes stats or timeline"""
+        if self._snapshot is None:
+            self._snapshot = json.dumps({'stats': self.stats, 'timeline': self.timeline.tail(5),
+                                         'quantiles': self.quantile_summary})
+            self._snapshot_sse = f'data: {self._snapshot}\n\n'.encode()
+        return self._snapshot
+    
     async def handle_websocket(self, request):
         """Handle WebSocket connections"""
-        ws = web.WebSocketResponse()
-        await ws.prepare(request)
-        self.websockets.add(ws)
+        refused = self.connections.admit(request.remote)
+        if refused:
+            # Refuse before the upgrade so it costs no more than a plain HTTP reply
+            return web.json_response({'error': 'too_many_connections', 'reason': refused},
+                                     status=429 if refused == 'max_per_ip' else 503,
+                                     headers={'Retry-After': '30'})
+        # admit() reserved a slot, so upgrades held by pacing still count against the caps
+        registered = False
+        try:
+            accept, wait = self.connections.pace()
+            if not accept:
+                # Too many arrivals at once: hand back a retry hint instead of a snapshot
+                ws = web.WebSocketResponse()
+                await ws.prepare(request)
+                await ws.send_json({'type': 'reconnect', 'retry_after': int(wait * 1000)})
+                await ws.close(code=aiohttp.WSCloseCode.TRY_AGAIN_LATER, message=b'busy')
+                return ws
+            if wait:
+                await asyncio.sleep(wait)
+            ws = self.connections.response()
+            await ws.prepare(request)
+            client_id = self.client_id(request, session=f'ws:{uuid.uuid4().hex[:8]}')
+            self.connections.add(ws, request, client_id)
+            registered = True
+        finally:
+            if not registered:
+                self.connections.release(request.remote)
+        for room in request.query.get('rooms', '').split(','):
+            if room:
+                self.rooms.subscribe(ws, room)
+        if not self.rooms.rooms(ws):
+            self.rooms.subscribe(ws, self.rooms.default_room)
         
         try:
             # Send initial stats
-            await ws.send_json({
-                'stats': self.stats,
-                'timeline': self.timeline[-5:]
-            })
+            await ws.send_str(self.snapshot())
             
             async for msg in ws:
                 if msg.type == aiohttp.WSMsgType.TEXT:
-                    data = json.loads(msg.data)
-                    
-                    if data.get('type') == 'query':
-                        query = data.get('query', '')
-                        result = await self.run_grok_agent(query)
+                    self.connections.received(ws, len(msg.data))
+                    if msg.data == '{"type":"ping"}':
+                        continue  # Client keepalive; only refreshes the idle timer
+                    # aiohttp hands over the message already read, so tracing starts at its arrival
+                    trace = self.tracer.start('ws.query', remote=request.remote, bytes=len(msg.data))
+                    try:
+                        with span('json.parse'):
+                            data = await offload.decode(msg.data)
                         
-                        # Broadcast to all connected clients
-                        for client_ws in self.websockets:
+                        if data.get('type') in ('subscribe', 'unsubscribe'):
+                            room = data.get('room')
+                            error = None
+                            if data['type'] == 'subscribe':
+                                error = self.rooms.subscribe(ws, room)
+                            else:
+                                self.rooms.unsubscribe(ws, room)
+                            reply = {'type': 'rooms', 'rooms': self.rooms.rooms(ws)}
+                            if error:
+                                reply['error'] = error
+                            await ws.send_json(reply)
+                        
+                        elif data.get('type') == 'query':
+                            new_request_id()
+                            started = time.monotonic()
+                            if self.draining:
+                                # A successor is serving; send the query there
+                                await self.send_reconnect(ws, immediate=True)
+                                continue
+                            query = data.get('query', '')
+                            room = data.get('room')
+                            if not self.rooms.valid(room):
+                                room = self.rooms.default_room
+                            self.inflight += 1
+                            self.busy.add(ws)
                             try:
-                                await client_ws.send_json(result)
-                            except:
-                                pass
+                                async with self.admission.slot('interactive'):
+                                    result = await self.run_grok_agent(query, client_id)
+                                with span('broadcast', room=room):
+                                    await self.coalescer.add_output(room, result['output'], sender=ws)
+                            except (AdmissionRejected, QuotaExceeded) as e:
+                                # Shed early: tell only this client to retry later
+                                await ws.send_json(self.overload_payload(e))
+                                log.info('ws.query.shed', client=client_id, reason=e.reason,
+                                         retry_after=e.retry_after)
+                            else:
+                                elapsed_ms = (time.monotonic() - started) * 1000
+                                self.quantiles.record('e2e_ms', elapsed_ms)
+                                log.info('ws.query', client=client_id, chars=len(query),
+                                         duration_ms=round(elapsed_ms, 1), clients=len(self.websockets))
+                            finally:
+                                self.inflight -= 1
+                                self.busy.discard(ws)
+                            if self.draining:
+                                # Deliver the answer before the reconnect, then this client can move over
+                                await self.coalescer.flush(force=True)
+                                await self.send_reconnect(ws)
+                    finally:
+                        self.tracer.finish(trace)
                                 
                 elif msg.type == aiohttp.WSMsgType.ERROR:
-                    print(f'WebSocket error: {ws.exception()}')
+                    log.warning('ws.error', client=client_id, error=str(msg.data))
+                    self.connections.errored(ws, msg.data)
                     
         except Exception as e:
-            print(f"WebSocket error: {e}")
+            log.error('ws.error', client=client_id, error=str(e), error_type=type(e).__name__)
         finally:
-            self.websockets.discard(ws)
+            self.connections.remove(ws)
+            self.rooms.remove(ws)
+            self.busy.discard(ws)
             
         return ws
     
+    def reconnect_delay(self) -> int:
+        """Milliseconds before a client reconnects, spread so they do not all arrive at once"""
+        return int(random.uniform(0, self.reconnect_spread) * 1000)
+    
+    async def send_reconnect(self, ws, immediate: bool = False):
+        try:
+            await ws.send_json({'type': 'reconnect',
+                                'retry_after': 0 if immediate else self.reconnect_delay()})
+        except Exception:
+            pass
+    
+    async def drain(self, timeout: float):
+        """Hand clients to the successor and let in-flight queries finish within timeout"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.draining = True
+        self.ready = False
+        self.warmer.stop()
+        # Queued jobs are left for the successor; the ones running here finish below
+        await self.jobs.stop()
+        # The successor has loaded the search file and now owns its compaction; we only append
+        self.search.compaction = False
+        
+        # SSE viewers reconnect by themselves after the retry hint
+        self.events.close_all()
+        # Idle WebSocket clients move now; busy ones after their answer arrives
+        for ws in list(self.websockets):
+            if ws not in self.busy:
+                await self.send_reconnect(ws)
+        
+        while (self.inflight or self.jobs.running) and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.inflight or self.jobs.running:
+            # Unfinished jobs go back on the queue once this process has exited
+            log.warning('recycle.drain_deadline', inflight=self.inflight, jobs=self.jobs.running, timeout_s=timeout)
+        
+        await self.coalescer.flush(force=True)
+        for ws in list(self.websockets):
+            await ws.close(code=aiohttp.WSCloseCode.SERVICE_RESTART, message=b'restarting')
+        log.info('recycle.drained', websockets=len(self.websockets))
+    
+    async def push_quantiles(self):
+        """Broadcast percentile summaries at a fixed rate, only when they changed and someone is watching"""
+        while True:
+            await asyncio.sleep(self.quantile_interval)
+            if not (self.websockets or self.events.subscribers):
+                continue
+            summary = self.quantiles.summary()
+            if summary != self.quantile_summary:
+                self.quantile_summary = summary
+                self._snapshot = None
+                await self.broadcast({'quantiles': summary})
+    
+    def broadcast_state(self) -> Dict[str, Any]:
+        """Stats and recent timeline, as merged into each coalesced frame"""
+        return {'stats': self.stats, 'timeline': self.timeline.tail(5)}
+    
+    async def broadcast(self, payload: Dict[str, Any]):
+        """Send a payload to all connected clients at once (answers go through the coalescer)"""
+        # Serialized once (off the loop when large); SSE viewers are fed from the same event
+        event = self.events.publish(payload, await offload.encode(payload))
+        for client_ws in list(self.websockets):
+            try:
+                await client_ws.send_str(event.data)
+                self.connections.sent(client_ws, len(event.data))
+            except:
+                pass
+    
+    async def events_handler(self, request):
+        """Server-Sent Events feed for read-only viewers, resumable via Last-Event-ID"""
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        })
+        await response.prepare(request)
+        
+        # Viewers of one room see its frames plus the ones sent to everyone
+        room = request.query.get('room', self.rooms.default_room)
+        # Subscribe before replaying so nothing published meanwhile is lost
+        queue = self.events.subscribe()
+        try:
+            last_id = request.headers.get('Last-Event-ID') or request.query.get('lastEventId')
+            resumed, missed = self.events.since(last_id)
+            await response.write(b'retry: 3000\n\n')
+            if not resumed:
+                self.snapshot()
+                await response.write(self._snapshot_sse)
+            last_seq = missed[-1].seq if missed else self.events.seq if resumed else 0
+            for event in missed:
+                if event.room is None or event.room == room:
+                    await response.write(event.sse)
+            
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.sse_keepalive)
+                except asyncio.TimeoutError:
+                    await response.write(b': keepalive\n\n')
+                    continue
+                if event is None:
+                    if self.draining:
+                        await response.write(f'retry: {self.reconnect_delay()}\n\n'.encode())
+                    break  # Dropped for falling behind (or restarting); the browser resumes from its last id
+                if event.seq > last_seq and (event.room is None or event.room == room):
+                    await response.write(event.sse)
+        except ConnectionResetError:
+            pass
+        finally:
+            self.events.unsubscribe(queue)
+        return response
+    
+    async def on_startup(self, app):
+        """Warm upstream connections in the background; /readyz flips once done"""
+        app['warmup'] = asyncio.create_task(self.warm_up())
+        # Baseline after imports and setup, so diffs show growth while serving
+        self.memory.start()
+        self.loop_monitor.start()
+        if self.quantile_interval > 0:
+            self._quantile_task = asyncio.create_task(self.push_quantiles())
+        await self.jobs.start()
+        # A large history loads in the background; searches meanwhile see what is in so far
+        self._search_task = asyncio.create_task(self.search.start())
+    
+    async def warm_up(self):
+        status = await self.grok.warm_up()
+        if status['state'] == 'warm':
+            log.info('upstream.warm', connections=status['connections'], requested=status['requested'],
+                     endpoints=len(status['endpoints']), duration_ms=status['duration_ms'])
+        else:
+            errors = '; '.join(e.get('error', '') for e in status['endpoints'].values())
+            log.warning('upstream.warm_failed', error=errors)
+        self.grok.start_refresh()
+        self.warmer.start()
+        # A failed warm-up still completes startup; queries will connect on demand
+        self.ready = True
+        notify_ready()
+    
+    async def on_cleanup(self, app):
+        app['warmup'].cancel()
+        log.info('server.stop')
+        self.warmer.stop()
+        self.loop_monitor.stop()
+        self.coalescer.close()
+        if self._quantile_task is not None:
+            self._quantile_task.cancel()
+        await self.jobs.stop()
+        await self.connections.close()
+        await self.grok.close()
+        offload.close()
+        self.jobs.close()
+        if self._search_task is not None:
+            self._search_task.cancel()
+        await self.search.close()
+    
+    async def healthz_handler(self, request):
+        """Liveness: the process is up and serving"""
+        return web.json_response({'status': 'ok'})
+    
+    async def readyz_handler(self, request):
+        """Readiness: upstream warm-up has completed and the process is not draining"""
+        body = {'ready': self.ready, 'upstream': self.grok.warm_status}
+        return web.json_response(body, status=200 if self.ready else 503)
+    
     async def index_handler(self, request):
         """Serve the Matrix HTML interface"""
         return web.Response(text=MATRIX_HTML, content_type='text/html')
     
     async def api_handler(self, request):
         """REST API endpoint for queries"""
-        data = await request.json()
+        trace = self.tracer.start('rest.query', remote=request.remote)
+        rid = new_request_id()
+        started = time.monotonic()
+        try:
+            with span('json.parse'):
+                data = await offload.decode(await request.read())
+            query = data.get('query', '')
+            # Counted while still queued for admission too, so drain() waits for it
+            self.inflight += 1
+            try:
+                async with self.admission.slot('batch'):
+                    result = await self.run_grok_agent(query, self.client_id(request))
+            finally:
+                self.inflight -= 1
+        except AdmissionRejected as e:
+            log.info('rest.query.shed', client=self.client_id(request), reason=e.reason)
+            return web.json_response(self.overload_payload(e), status=503,
+                                     headers={'Retry-After': str(e.retry_after), 'X-Request-Id': rid})
+        except QuotaExceeded as e:
+            log.info('rest.query.shed', client=self.client_id(request), reason=e.reason)
+            return web.json_response(self.overload_payload(e), status=429,
+                                     headers={'Retry-After': str(e.retry_after), 'X-Request-Id': rid})
+        finally:
+            self.tracer.finish(trace)
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self.quantiles.record('e2e_ms', elapsed_ms)
+        log.info('rest.query', client=self.client_id(request), chars=len(query), duration_ms=round(elapsed_ms, 1))
+        return web.json_response(result, headers={'X-Request-Id': rid})
+    
+    async def run_job(self, query: str, client_id: str) -> Dict[str, Any]:
+        """One queued job: the raw answer, through the same admission lane and scheduler as REST"""
+        self.timeline.append('query', 'job', args=query[:200], client=client_id)
+        self._snapshot = None
+        await self.coalescer.mark_state()
+        async with self.admission.slot('batch'):
+            result = await self.scheduler.chat_completion(query, client_id=client_id)
+        if result['success'] and not result.get('cached'):
+            if result.get('latency_ms') is not None:
+                self.quantiles.record('upstream_ms', result['latency_ms'])
+            self.quantiles.record('tokens', (result.get('usage') or {}).get('total_tokens', 0))
+            self.search.add(query, result['content'], client_id)
+        return result
+    
+    async def submit_job_handler(self, request):
+        """POST /api/jobs: queue a query and return its id at once"""
+        data = await offload.decode(await request.read())
         query = data.get('query', '')
-        result = await self.run_grok_agent(query)
-        return web.json_response(result)
+        if not query:
+            return web.json_response({'error': 'query is required'}, status=400)
+        try:
+            job = await self.jobs.submit(query, self.client_id(request))
+        except QueueFull as e:
+            log.info('job.shed', client=self.client_id(request), queued=e.queued)
+            return web.json_response({'error': 'job queue full', 'retry_after': e.retry_after}, status=503,
+                                     headers={'Retry-After': str(e.retry_after)})
+        location = f"/api/jobs/{job['id']}"
+        return web.json_response(dict(job, poll=location), status=202, headers={'Location': location})
+    
+    async def job_handler(self, request):
+        """GET /api/jobs/{id}[?wait=seconds]: status, or the result once finished (long-polls with wait)"""
+        try:
+            wait = float(request.query.get('wait', '0'))
+            if not wait >= 0:
+                raise ValueError('wait must be a non-negative number of seconds')
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        job = await self.jobs.get(request.match_info['job_id'], wait)
+        if job is None:
+            return web.json_response({'error': 'unknown or expired job'}, status=404)
+        return web.json_response(job)
+    
+    async def jobs_stats_handler(self, request):
+        """Job counts by status, worker activity, retries and recovered orphans"""
+        return web.json_response(await self.jobs.stats())
+    
+    def client_id(self, request, session: str = None) -> str:
+        """Identify the caller by API token, X-Client-Id header, WebSocket session or address"""
+        auth = request.headers.get('Authorization', '')
+        token = auth[7:] if auth.startswith('Bearer ') else request.query.get('token')
+        if token:
+            # Never expose raw tokens in stats
+            return 'key:' + hashlib.sha256(token.encode()).hexdigest()[:12]
+        if request.headers.get('X-Client-Id'):
+            return request.headers['X-Client-Id'][:64]
+        return session or f'ip:{request.remote}'
+    
+    def overload_payload(self, error) -> Dict[str, Any]:
+        """Error frame for a shed or over-quota query"""
+        return {
+            'type': 'error',
+            'error': 'quota_exceeded' if isinstance(error, QuotaExceeded) else 'overloaded',
+            'reason': error.reason,
+            'retry_after': error.retry_after,
+            'output': f"""<div style='color: #ff0000;'>❌ Error: Server busy ({error.reason}), retry in {error.retry_after}s</div>"""
+        }
+    
+    async def admission_handler(self, request):
+        """Admission queue length, wait times and shed counts"""
+        return web.json_response(self.admission.stats())
+    
+    async def connections_handler(self, request):
+        """Open WebSockets with per-connection traffic, plus limits, close reasons and memory"""
+        try:
+            limit = parse_count(request.query.get('limit'), 50)
+        except ValueError as e:
+            return bad_request(e)
+        return web.json_response(self.connections.stats(limit))
+    
+    async def warming_handler(self, request):
+        """Queries kept warm in the answer cache, their expiry and the warming spend"""
+        return web.json_response(self.warmer.stats())
+    
+    async def offload_handler(self, request):
+        """Payload work done inline vs in the worker pool, with pool queue depth and wait times"""
+        return web.json_response(offload.stats())
+    
+    async def limiter_handler(self, request):
+        """Adaptive upstream concurrency: current limit, latency baseline vs recent, and limit history"""
+        try:
+            history = parse_count(request.query.get('history'), 50)
+        except ValueError as e:
+            return bad_request(e)
+        return web.json_response(self.grok.limiter.stats(history))
+    
+    async def broadcast_handler(self, request):
+        """Coalescing tick, flushes, answers merged per flush and frames sent"""
+        return web.json_response(self.coalescer.stats())
+    
+    async def rooms_handler(self, request):
+        """Rooms with their members and per-room frames and bytes sent"""
+        try:
+            limit = parse_count(request.query.get('limit'), 50)
+        except ValueError as e:
+            return bad_request(e)
+        return web.json_response(self.rooms.stats(limit))
+    
+    async def quantiles_handler(self, request):
+        """Upstream latency, end-to-end latency and tokens per request over the sliding window"""
+        return web.json_response(self.quantiles.summary((0.5, 0.9, 0.95, 0.99, 0.999)))
+    
+    async def loop_handler(self, request):
+        """Event-loop scheduling lag histogram and the slowest recent callbacks"""
+        return web.json_response(self.loop_monitor.stats())
+    
+    def memory_structures(self) -> Dict[str, Any]:
+        """Approximate sizes of the agent's long-lived structures (runs in a worker thread)"""
+        # Containers the loop may change meanwhile are copied first, in one step each
+        connections = sorted(list(self.connections.sockets.values()), key=lambda i: i.write_buffer(), reverse=True)
+        history = list(self.events.history)
+        return {
+            'timeline': {'events': len(self.timeline), 'bytes': self.timeline.nbytes()},
+            'websockets': {
+                'open': len(self.websockets),
+                'write_buffers_bytes': sum(i.write_buffer() for i in connections),
+                'largest_write_buffers': [{'id': i.id, 'ip': i.ip, 'bytes': i.write_buffer()}
+                                          for i in connections[:5]]
+            },
+            'event_replay': {
+                'events': len(history),
+                'bytes': sum(len(e.data) + len(e.sse) for e in history),
+                'sse_queued': sum(q.qsize() for q in list(self.events.subscribers))
+            },
+            'fragments': {'entries': len(self.fragments.fragments), 'bytes': self.fragments.stats()['bytes']},
+            'answer_cache': {'entries': len(self.grok.cache.entries),
+                             'bytes': deep_size(self.grok.cache.entries)},
+            'traces': {'entries': len(self.tracer.traces),
+                       'bytes': sum(deep_size(t.spans) for t in list(self.tracer.traces))},
+            'scheduler_clients': {'entries': len(self.scheduler.clients),
+                                  'bytes': deep_size(self.scheduler.clients)},
+            'warming_scores': {'entries': len(self.warmer.scores), 'bytes': deep_size(self.warmer.scores)}
+        }
+    
+    async def memory_handler(self, request):
+        """Opt-in (GROK_DEBUG_MEMORY=1): tracemalloc growth by line and module, plus structure sizes"""
+        if not self.memory.enabled:
+            return web.json_response({'error': 'memory profiling is off; start with GROK_DEBUG_MEMORY=1'},
+                                     status=404)
+        try:
+            top = parse_count(request.query.get('top'), 25)
+        except ValueError as e:
+            return bad_request(e)
+        loop = asyncio.get_running_loop()
+        if request.query.get('reset'):
+            await loop.run_in_executor(None, self.memory.reset)
+        compare = 'baseline' if request.query.get('compare') == 'baseline' else 'previous'
+        # Snapshot diffs take a while on a big heap; keep them off the event loop
+        report = await loop.run_in_executor(None, self.memory.report, compare, top)
+        # So do the structure walks and, only when asked for, the whole-heap object count
+        process = await loop.run_in_executor(None, self.memory.process, bool(request.query.get('objects')))
+        structures = await loop.run_in_executor(None, self.memory_structures)
+        return web.json_response({
+            'process': process,
+            'structures': structures,
+            'tracemalloc': report
+        })
+    
+    async def render_handler(self, request):
+        """Rendered-fragment cache size and hit rate"""
+        return web.json_response(self.fragments.stats())
+    
+    async def upstream_handler(self, request):
+        """Per-backend health, outstanding requests and usage"""
+        return web.json_response(self.grok.stats())
+    
+    async def scheduler_handler(self, request):
+        """Upstream scheduler queue, token budget and estimator accuracy"""
+        return web.json_response(self.scheduler.stats())
+    
+    async def timeline_handler(self, request):
+        """Range query over the event store: ?from=&to=&tool=&kind=&limit=&cursor=&order="""
+        try:
+            start = parse_time(request.query.get('from'))
+            end = parse_time(request.query.get('to'))
+            limit = max(1, min(int(request.query.get('limit', '100')), 1000))
+            cursor = request.query.get('cursor')
+            page = self.timeline.query(
+                start=start, end=end,
+                tool=request.query.get('tool'),
+                kind=request.query.get('kind'),
+                limit=limit,
+                cursor=int(cursor) if cursor else None,
+                descending=request.query.get('order') == 'desc'
+            )
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        if page['next_cursor'] is not None:
+            page['next_cursor'] = str(page['next_cursor'])
+        return web.json_response(page)
+    
+    async def search_handler(self, request):
+        """Ranked full-text search over past queries and answers: ?q=&limit="""
+        q = request.query.get('q', '').strip()
+        if not q:
+            return web.json_response({'error': 'q is required'}, status=400)
+        try:
+            limit = max(1, min(int(request.query.get('limit', '20')), 100))
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        return web.json_response(self.search.search(q, limit))
+    
+    async def search_stats_handler(self, request):
+        """Search index size, eviction and persistence"""
+        return web.json_response(self.search.stats())
+    
+    async def logging_handler(self, request):
+        """Log writer queue depth, batches, drops and suppressed repeats"""
+        return web.json_response(log.stats())
+    
+    async def traces_handler(self, request):
+        """Recent query traces, as JSON or Chrome trace-event format (?format=chrome)"""
+        try:
+            limit = parse_count(request.query.get('limit'), 50)
+        except ValueError as e:
+            return bad_request(e)
+        traces = self.tracer.recent(limit)
+        if request.query.get('format') == 'chrome':
+            return web.json_response(Tracer.to_chrome(traces), headers={
+                'Content-Disposition': 'attachment; filename="grok-traces.json"'
+            })
+        return web.json_response({
+            'tracer': self.tracer.stats(),
+            'traces': [t.to_dict() for t in traces]
+        })
+
+def parse_time(value: str):
+    """Epoch seconds or an ISO 8601 timestamp"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+def parse_count(value: str, default: int, maximum: int = 1000) -> int:
+    """A positive integer query parameter, capped at maximum (ValueError if not an integer)"""
+    if not value:
+        return default
+    return max(1, min(int(value), maximum))
+
+def bad_request(error: ValueError):
+    return web.json_response({'error': str(error)}, status=400)
 
 def create_app():
     """Create the web application"""
     agent = GrokMindAgent()
     app = web.Application()
+    app['agent'] = agent
     
     # Setup CORS
     cors = aiohttp_cors.setup(app, defaults={
@@ -657,6 +1339,34 @@ def create_app():
     app.router.add_get('/', agent.index_handler)
     app.router.add_get('/ws', agent.handle_websocket)
     app.router.add_post('/api/query', agent.api_handler)
+    app.router.add_post('/api/jobs', agent.submit_job_handler)
+    app.router.add_get('/api/jobs/{job_id}', agent.job_handler)
+    app.router.add_get('/events', agent.events_handler)
+    app.router.add_get('/api/timeline', agent.timeline_handler)
+    app.router.add_get('/api/search', agent.search_handler)
+    app.router.add_get('/debug/traces', agent.traces_handler)
+    app.router.add_get('/debug/admission', agent.admission_handler)
+    app.router.add_get('/debug/scheduler', agent.scheduler_handler)
+    app.router.add_get('/debug/upstream', agent.upstream_handler)
+    app.router.add_get('/debug/render', agent.render_handler)
+    app.router.add_get('/debug/warming', agent.warming_handler)
+    app.router.add_get('/debug/memory', agent.memory_handler)
+    app.router.add_get('/debug/logging', agent.logging_handler)
+    app.router.add_get('/debug/loop', agent.loop_handler)
+    app.router.add_get('/debug/offload', agent.offload_handler)
+    app.router.add_get('/debug/quantiles', agent.quantiles_handler)
+    app.router.add_get('/debug/jobs', agent.jobs_stats_handler)
+    app.router.add_get('/debug/rooms', agent.rooms_handler)
+    app.router.add_get('/debug/broadcast', agent.broadcast_handler)
+    app.router.add_get('/debug/limiter', agent.limiter_handler)
+    app.router.add_get('/debug/search', agent.search_stats_handler)
+    app.router.add_get('/debug/connections', agent.connections_handler)
+    app.router.add_get('/healthz', agent.healthz_handler)
+    app.router.add_get('/readyz', agent.readyz_handler)
+    
+    # Startup phase: warm upstream connections before reporting ready
+    app.on_startup.append(agent.on_startup)
+    app.on_cleanup.append(agent.on_cleanup)
     
     # Configure CORS on all routes
     for route in list(app.router.routes()):
@@ -677,10 +1387,13 @@ def main():
     print("🟢 Starting Matrix Interface on http://localhost:8080")
     print("🔧 WebSocket endpoint: ws://localhost:8080/ws")
     print("📡 API endpoint: http://localhost:8080/api/query")
+    print(f"♻️ Graceful restart: kill -HUP {os.getpid()}")
     print("\nPress Ctrl+C to exit\n")
     
+    if install_uvloop():
+        print("⚡ Event loop: uvloop")
     app = create_app()
-    web.run_app(app, host='0.0.0.0', port=8080)
+    asyncio.run(serve(app, '0.0.0.0', 8080, app['agent'].drain))
 
 if __name__ == "__main__":
     try:
@@ -690,4 +1403,6 @@ if __name__ == "__main__":
         sys.exit(0)
     except Exception as e:
         print(f"\n❌ ERROR: {str(e)}")
+        log.error('server.crash', error=str(e), error_type=type(e).__name__)
+        log.close()
         sys.exit(1)
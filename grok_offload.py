@@ -0,0 +1,146 @@
+"""
+Size-aware offloading of CPU-heavy payload work (JSON decode/encode, rendering)
+
+Small payloads are handled inline: a hop to a worker costs more than the work.
+Payloads above the threshold go to a thread pool (or a process pool, for
+renders big enough that the GIL would still slow the loop), so one large answer
+cannot stall every other connection.
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+def _timed(fn: Callable, *args):
+    """Runs in the worker: the result plus when it started (wall clock, comparable across processes)"""
+    started = time.time()
+    result = fn(*args)
+    return result, started, time.time() - started
+
+
+def encode_json(payload: Any) -> str:
+    return json.dumps(payload)
+
+
+def payload_size(payload: Any) -> int:
+    """Cheap size estimate for a frame before it is serialized: its strings dominate"""
+    if isinstance(payload, (str, bytes)):
+        return len(payload)
+    if isinstance(payload, dict):
+        return sum(payload_size(v) for v in payload.values()) + 16 * len(payload)
+    if isinstance(payload, (list, tuple)):
+        return sum(payload_size(v) for v in payload) + 8 * len(payload)
+    return 8
+
+
+class KindStats:
+    """Counters for one kind of work (decode, encode, render)"""
+
+    __slots__ = ('inline', 'offloaded', 'queue_wait', 'queue_wait_max', 'run_time', 'run_time_max', 'bytes')
+
+    def __init__(self):
+        self.inline = 0
+        self.offloaded = 0
+        self.queue_wait = 0.0
+        self.queue_wait_max = 0.0
+        self.run_time = 0.0
+        self.run_time_max = 0.0
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        n = self.offloaded or 1
+        return {
+            'inline': self.inline,
+            'offloaded': self.offloaded,
+            'offloaded_bytes': self.bytes,
+            'queue_wait_ms': {'mean': round(self.queue_wait / n * 1000, 2),
+                              'max': round(self.queue_wait_max * 1000, 2)},
+            'run_ms': {'mean': round(self.run_time / n * 1000, 2),
+                       'max': round(self.run_time_max * 1000, 2)}
+        }
+
+
+class PayloadOffloader:
+    """Runs work inline below threshold_bytes and in a bounded worker pool above it"""
+
+    def __init__(self, threshold_bytes: int = None, executor: str = None, workers: int = None):
+        if threshold_bytes is None:
+            # GROK_RENDER_OFFLOAD_BYTES predates the shared threshold and still applies
+            threshold_bytes = int(os.getenv('GROK_OFFLOAD_BYTES', os.getenv('GROK_RENDER_OFFLOAD_BYTES', '32768')))
+        if executor is None:
+            executor = os.getenv('GROK_OFFLOAD_EXECUTOR', 'thread')
+        if workers is None:
+            workers = int(os.getenv('GROK_OFFLOAD_WORKERS', str(min(4, os.cpu_count() or 1))))
+        self.threshold = threshold_bytes
+        self.kind = executor
+        self.workers = workers
+        self.pool: Optional[Executor] = None
+        self.pending = 0
+        self.pending_max = 0
+        self.kinds: Dict[str, KindStats] = {}
+
+    def _executor(self) -> Executor:
+        if self.pool is None:
+            if self.kind == 'process':
+                # Spawned, not forked: workers must not inherit the listening socket or loop state
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            else:
+                self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='grok-offload')
+        return self.pool
+
+    async def run(self, kind: str, size: int, fn: Callable, *args) -> Any:
+        """fn(*args), inline when size is below the threshold, otherwise in the pool"""
+        counters = self.kinds.get(kind)
+        if counters is None:
+            counters = self.kinds[kind] = KindStats()
+        if size < self.threshold:
+            counters.inline += 1
+            return fn(*args)
+
+        counters.offloaded += 1
+        counters.bytes += size
+        self.pending += 1
+        self.pending_max = max(self.pending_max, self.pending)
+        submitted = time.time()
+        try:
+            result, started, elapsed = await asyncio.get_running_loop().run_in_executor(
+                self._executor(), _timed, fn, *args)
+        finally:
+            self.pending -= 1
+        waited = max(0.0, started - submitted)
+        counters.queue_wait += waited
+        counters.queue_wait_max = max(counters.queue_wait_max, waited)
+        counters.run_time += elapsed
+        counters.run_time_max = max(counters.run_time_max, elapsed)
+        return result
+
+    async def decode(self, data, kind: str = 'decode') -> Any:
+        """json.loads for str or bytes"""
+        return await self.run(kind, len(data), json.loads, data)
+
+    async def encode(self, payload: Any, kind: str = 'encode') -> str:
+        """json.dumps, sized by the strings in the payload"""
+        return await self.run(kind, payload_size(payload), encode_json, payload)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'executor': self.kind,
+            'workers': self.workers,
+            'threshold_bytes': self.threshold,
+            'pending': self.pending,
+            'pending_max': self.pending_max,
+            'kinds': {kind: counters.stats() for kind, counters in self.kinds.items()}
+        }
+
+
+offload = PayloadOffloader()
@@ -0,0 +1,138 @@
+"""
+Zero-downtime restarts: hand the listening socket to a new process, then drain
+"""
+
+import asyncio
+import os
+import signal
+import socket
+import subprocess
+import sys
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+
+from grok_log import log
+
+LISTEN_FD = 'GROK_LISTEN_FD'
+READY_FD = 'GROK_READY_FD'
+
+
+def listening_socket(host: str, port: int) -> socket.socket:
+    """The socket inherited from the previous process, or a freshly bound one"""
+    fd = os.getenv(LISTEN_FD)
+    if fd:
+        sock = socket.socket(fileno=int(fd))
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+def predecessor() -> Optional[int]:
+    """Pid of the process that started us on a SIGHUP (it drains, then exits); None on a normal start"""
+    return os.getppid() if os.getenv(READY_FD) else None
+
+
+def notify_ready():
+    """Tell the process that started us we are serving; no-op on a normal start"""
+    fd = os.environ.pop(READY_FD, None)
+    if fd:
+        try:
+            os.write(int(fd), b'1')
+        finally:
+            os.close(int(fd))
+
+
+class Recycler:
+    """On SIGHUP: start a successor on the same socket, wait until it is ready, then drain and exit"""
+
+    def __init__(self, sock: socket.socket, drain: Callable[[float], Awaitable[None]],
+                 ready_timeout: float = None, drain_timeout: float = None):
+        if ready_timeout is None:
+            ready_timeout = float(os.getenv('GROK_RECYCLE_READY_TIMEOUT', '30'))
+        if drain_timeout is None:
+            drain_timeout = float(os.getenv('GROK_DRAIN_TIMEOUT', '30'))
+        self.sock = sock
+        self.drain = drain
+        self.ready_timeout = ready_timeout
+        self.drain_timeout = drain_timeout
+        self.site: Optional[web.SockSite] = None
+        self.successor: Optional[subprocess.Popen] = None
+        self.recycling = False
+        self.done = asyncio.Event()
+
+    def install(self):
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.recycle()))
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.done.set)
+
+    def spawn(self) -> int:
+        """Start a copy of this process sharing the listening socket; returns the readiness pipe"""
+        ready_r, ready_w = os.pipe()
+        env = dict(os.environ, **{LISTEN_FD: str(self.sock.fileno()), READY_FD: str(ready_w)})
+        self.successor = subprocess.Popen([sys.executable] + sys.argv, env=env,
+                                          pass_fds=(self.sock.fileno(), ready_w))
+        os.close(ready_w)
+        os.set_blocking(ready_r, False)
+        return ready_r
+
+    async def wait_ready(self, ready_r: int) -> bytes:
+        """The successor's readiness byte, b'' if it exits first (the loop watches the fd: no thread blocks on it)"""
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+        loop.add_reader(ready_r, lambda: readable.done() or readable.set_result(None))
+        try:
+            await asyncio.wait_for(readable, self.ready_timeout)
+            return os.read(ready_r, 1)
+        finally:
+            loop.remove_reader(ready_r)
+
+    async def recycle(self):
+        if self.recycling:
+            return
+        self.recycling = True
+        ready_r = self.spawn()
+        log.info('recycle.spawned', pid=self.successor.pid)
+        try:
+            ready = await self.wait_ready(ready_r)
+        except asyncio.TimeoutError:
+            ready = b''
+        finally:
+            os.close(ready_r)
+
+        if ready != b'1':
+            # Never hand over to a process that did not come up: keep serving
+            log.warning('recycle.successor_not_ready', pid=self.successor.pid, timeout_s=self.ready_timeout)
+            self.successor.terminate()
+            self.successor = None
+            self.recycling = False
+            return
+
+        # The successor accepts from the same socket; stop competing for connections
+        if self.site is not None:
+            await self.site.stop()
+        log.info('recycle.handover', pid=self.successor.pid, drain_timeout_s=self.drain_timeout)
+        await self.drain(self.drain_timeout)
+        self.done.set()
+
+
+async def serve(app: web.Application, host: str, port: int,
+                drain: Callable[[float], Awaitable[None]]):
+    """Run the app on an inheritable socket until stopped or recycled"""
+    sock = listening_socket(host, port)
+    recycler = Recycler(sock, drain)
+    recycler.install()
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    recycler.site = web.SockSite(runner, sock)
+    await recycler.site.start()
+    try:
+        await recycler.done.wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,163 @@
+"""
+Server-side Markdown rendering with a cache of rendered fragments
+"""
+
+import hashlib
+import html
+import os
+import re
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from grok_offload import offload
+
+CODE_SPAN = re.compile(r'`([^`\n]+)`')
+BOLD = re.compile(r'\*\*(.+?)\*\*|__(.+?)__')
+ITALIC = re.compile(r'(?<![\w*])\*(?!\s)(.+?)(?<!\s)\*(?![\w*])|(?<![\w_])_(?!\s)(.+?)(?<!\s)_(?![\w_])')
+LINK = re.compile(r'\[([^\]]+)\]\(((?:https?://|mailto:)[^\s)]+)\)')
+HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*$')
+BULLET = re.compile(r'^\s*[-*+]\s+(.*)$')
+NUMBERED = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+FENCE = re.compile(r'^\s*```')
+
+
+def _inline(text: str) -> str:
+    """Inline Markdown on already-escaped text"""
+    codes = []
+
+    def stash(match):
+        codes.append(f'<code>{match.group(1)}</code>')
+        return f'\x00{len(codes) - 1}\x00'
+
+    # Code spans are literal: keep them out of the other rules
+    text = CODE_SPAN.sub(stash, text)
+    text = LINK.sub(lambda m: f'<a href="{m.group(2)}" target="_blank" rel="noopener noreferrer">{m.group(1)}</a>', text)
+    text = BOLD.sub(lambda m: f'<strong>{m.group(1) or m.group(2)}</strong>', text)
+    text = ITALIC.sub(lambda m: f'<em>{m.group(1) or m.group(2)}</em>', text)
+    return re.sub(r'\x00(\d+)\x00', lambda m: codes[int(m.group(1))], text)
+
+
+def render_markdown(text: str) -> str:
+    """Render Markdown to HTML; all source HTML is escaped, so the output is safe to inject"""
+    out = []
+    paragraph = []
+    list_tag = None
+    code = None
+
+    def flush_paragraph():
+        if paragraph:
+            out.append('<p>' + '<br>'.join(_inline(line) for line in paragraph) + '</p>')
+            paragraph.clear()
+
+    def close_list():
+        nonlocal list_tag
+        if list_tag:
+            out.append(f'</{list_tag}>')
+            list_tag = None
+
+    # NUL delimits the code-span placeholders in _inline; it has no business in an answer
+    for raw in html.escape(text.replace('\x00', ''), quote=True).splitlines():
+        if code is not None:
+            if FENCE.match(raw):
+                out.append('<pre><code>' + '\n'.join(code) + '</code></pre>')
+                code = None
+            else:
+                code.append(raw)
+            continue
+        if FENCE.match(raw):
+            flush_paragraph()
+            close_list()
+            code = []
+            continue
+
+        line = raw.rstrip()
+        if not line.strip():
+            flush_paragraph()
+            close_list()
+            continue
+
+        heading = HEADING.match(line)
+        bullet = BULLET.match(line)
+        numbered = NUMBERED.match(line)
+        if re.fullmatch(r'\s*([-*_])(\s*\1){2,}\s*', line):
+            flush_paragraph()
+            close_list()
+            out.append('<hr>')
+        elif heading:
+            flush_paragraph()
+            close_list()
+            level = len(heading.group(1))
+            out.append(f'<h{level}>{_inline(heading.group(2))}</h{level}>')
+        elif bullet or numbered:
+            flush_paragraph()
+            tag = 'ul' if bullet else 'ol'
+            if list_tag != tag:
+                close_list()
+                out.append(f'<{tag}>')
+                list_tag = tag
+            out.append(f'<li>{_inline((bullet or numbered).group(1))}</li>')
+        elif line.startswith('&gt;'):
+            flush_paragraph()
+            close_list()
+            out.append(f'<blockquote>{_inline(line[4:].strip())}</blockquote>')
+        else:
+            close_list()
+            paragraph.append(line.strip())
+
+    if code is not None:
+        # Unterminated fence: render what we have
+        out.append('<pre><code>' + '\n'.join(code) + '</code></pre>')
+    flush_paragraph()
+    close_list()
+    return '\n'.join(out)
+
+
+class FragmentCache:
+    """Bounded LRU of rendered HTML keyed by a hash of the source content"""
+
+    def __init__(self, capacity: int = None):
+        if capacity is None:
+            capacity = int(os.getenv('GROK_RENDER_CACHE_SIZE', '512'))
+        self.capacity = capacity
+        self.fragments: 'OrderedDict[str, str]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(content: str) -> str:
+        return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[str]:
+        fragment = self.fragments.get(key)
+        if fragment is not None:
+            self.fragments.move_to_end(key)
+        return fragment
+
+    def put(self, key: str, fragment: str):
+        self.fragments[key] = fragment
+        self.fragments.move_to_end(key)
+        while len(self.fragments) > self.capacity:
+            self.fragments.popitem(last=False)
+
+    async def render(self, content: str) -> str:
+        """Rendered HTML for Markdown content, rendering at most once per distinct content"""
+        key = self.key(content)
+        fragment = self.get(key)
+        if fragment is not None:
+            self.hits += 1
+            return fragment
+        self.misses += 1
+        # Large answers render in a worker so other connections keep flowing
+        fragment = await offload.run('render', len(content), render_markdown, content)
+        self.put(key, fragment)
+        return fragment
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'fragments': len(self.fragments),
+            'capacity': self.capacity,
+            # Copied first: /debug/memory calls this from a worker while get() reorders the dict
+            'bytes': sum(len(f) for f in list(self.fragments.values())),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,136 @@
+"""
+Named rooms: WebSockets subscribe to topics and broadcasts reach only that room
+"""
+
+import os
+import re
+import time
+from typing import Dict, Any, Iterable, List, Optional, Set
+
+from aiohttp import web
+
+ROOM_NAME = re.compile(r'[A-Za-z0-9_.:-]{1,64}')
+
+
+class RoomStats:
+    """Traffic of one room; kept after it empties so quiet rooms still show their history"""
+
+    __slots__ = ('created_at', 'published', 'frames', 'bytes', 'subscribes', 'unsubscribes',
+                 'peak_members', 'last_publish')
+
+    def __init__(self):
+        self.created_at = time.time()
+        self.published = 0
+        self.frames = 0
+        self.bytes = 0
+        self.subscribes = 0
+        self.unsubscribes = 0
+        self.peak_members = 0
+        self.last_publish: Optional[float] = None
+
+
+class RoomIndex:
+    """room -> member sockets, kept in step with socket -> rooms so both lookups are O(1)"""
+
+    def __init__(self, default_room: str = None, max_per_connection: int = None, max_rooms: int = None):
+        if default_room is None:
+            default_room = os.getenv('GROK_DEFAULT_ROOM', 'lobby')
+        if max_per_connection is None:
+            max_per_connection = int(os.getenv('GROK_ROOMS_PER_CONNECTION', '16'))
+        if max_rooms is None:
+            max_rooms = int(os.getenv('GROK_MAX_ROOMS', '10000'))
+        self.default_room = default_room
+        self.max_per_connection = max_per_connection
+        self.max_rooms = max_rooms
+        self.members: Dict[str, Set[web.WebSocketResponse]] = {}
+        self.rooms_of: Dict[web.WebSocketResponse, Set[str]] = {}
+        self.traffic: Dict[str, RoomStats] = {}
+
+    @staticmethod
+    def valid(room: str) -> bool:
+        return isinstance(room, str) and ROOM_NAME.fullmatch(room) is not None
+
+    def subscribe(self, ws: web.WebSocketResponse, room: str) -> Optional[str]:
+        """Add ws to room; returns why it was refused, or None"""
+        if not self.valid(room):
+            return 'invalid_room'
+        joined = self.rooms_of.setdefault(ws, set())
+        if room in joined:
+            return None
+        if len(joined) >= self.max_per_connection:
+            return 'too_many_rooms'
+        if room not in self.members and len(self.members) >= self.max_rooms:
+            return 'too_many_rooms'
+        joined.add(room)
+        members = self.members.setdefault(room, set())
+        members.add(ws)
+        stats = self._stats(room)
+        stats.subscribes += 1
+        stats.peak_members = max(stats.peak_members, len(members))
+        return None
+
+    def unsubscribe(self, ws: web.WebSocketResponse, room: str):
+        joined = self.rooms_of.get(ws)
+        if not joined or room not in joined:
+            return
+        joined.discard(room)
+        members = self.members[room]
+        members.discard(ws)
+        if not members:
+            del self.members[room]
+        self._stats(room).unsubscribes += 1
+
+    def remove(self, ws: web.WebSocketResponse):
+        """Drop a closed socket from every room it was in"""
+        for room in list(self.rooms_of.get(ws, ())):
+            self.unsubscribe(ws, room)
+        self.rooms_of.pop(ws, None)
+
+    def rooms(self, ws: web.WebSocketResponse) -> List[str]:
+        return sorted(self.rooms_of.get(ws, ()))
+
+    def subscribers(self, room: str) -> Iterable[web.WebSocketResponse]:
+        return self.members.get(room, ())
+
+    def _stats(self, room: str) -> RoomStats:
+        stats = self.traffic.get(room)
+        if stats is None:
+            if len(self.traffic) >= self.max_rooms:
+                # Forget the traffic of rooms nobody is in, oldest first
+                for name in sorted((r for r in self.traffic if r not in self.members),
+                                   key=lambda r: self.traffic[r].last_publish or self.traffic[r].created_at):
+                    del self.traffic[name]
+                    if len(self.traffic) < self.max_rooms:
+                        break
+            stats = self.traffic[room] = RoomStats()
+        return stats
+
+    def published(self, room: str, answers: int, frames: int, size: int):
+        """answers delivered to the room in frames totalling size bytes"""
+        stats = self._stats(room)
+        stats.published += answers
+        stats.frames += frames
+        stats.bytes += size
+        stats.last_publish = time.time()
+
+    def stats(self, limit: int = 50) -> Dict[str, Any]:
+        busiest = sorted(self.traffic.items(), key=lambda item: item[1].frames, reverse=True)[:limit]
+        return {
+            'rooms': len(self.members),
+            'default_room': self.default_room,
+            'max_per_connection': self.max_per_connection,
+            'subscriptions': sum(len(m) for m in self.members.values()),
+            'by_room': {
+                room: {
+                    'members': len(self.members.get(room, ())),
+                    'peak_members': s.peak_members,
+                    'published': s.published,
+                    'frames_sent': s.frames,
+                    'bytes_sent': s.bytes,
+                    'subscribes': s.subscribes,
+                    'unsubscribes': s.unsubscribes,
+                    'last_publish': s.last_publish
+                }
+                for room, s in busiest
+            }
+        }
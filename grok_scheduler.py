@@ -0,0 +1,332 @@
+"""
+Cost-aware scheduling of upstream Grok calls
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from grok_api import DEFAULT_MODEL
+from grok_tracing import span
+
+# Words, numbers and individual punctuation marks roughly track BPE token boundaries
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+
+class QuotaExceeded(Exception):
+    """Raised when a client has used up its request or token quota"""
+
+    def __init__(self, client_id: str, reason: str, retry_after: int):
+        super().__init__(f'{client_id}: {reason}')
+        self.client_id = client_id
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenEstimator:
+    """Offline token estimate, calibrated against the usage the API reports"""
+
+    def __init__(self, completion_tokens: int = None):
+        if completion_tokens is None:
+            completion_tokens = int(os.getenv('GROK_EST_COMPLETION_TOKENS', '256'))
+        self.scale = 1.0                        # observed prompt tokens / estimated
+        self.avg_completion = float(completion_tokens)
+        self.overhead = 8                       # chat template tokens per message
+
+    @staticmethod
+    def _pieces(text: str) -> int:
+        pieces = 0
+        for match in TOKEN_PATTERN.finditer(text):
+            piece = match.group()
+            # Long words split into several tokens
+            pieces += 1 + len(piece) // 8 if piece.isalpha() else 1
+        return pieces
+
+    def prompt_tokens(self, text: str) -> int:
+        return int(self._pieces(text) * self.scale) + self.overhead
+
+    def estimate(self, text: str) -> int:
+        """Estimated total tokens (prompt + completion) for a query"""
+        return self.prompt_tokens(text) + int(self.avg_completion)
+
+    def observe(self, text: str, usage: Dict[str, Any]):
+        pieces = self._pieces(text)
+        if usage.get('prompt_tokens') and pieces > 0:
+            ratio = max(0, usage['prompt_tokens'] - self.overhead) / pieces
+            self.scale = 0.9 * self.scale + 0.1 * min(4.0, max(0.25, ratio))
+        if usage.get('completion_tokens') is not None:
+            self.avg_completion = 0.9 * self.avg_completion + 0.1 * usage['completion_tokens']
+
+
+class TokenBucket:
+    """Global token budget per minute (0 = unlimited); bursts up to a minute's worth unless capped"""
+
+    def __init__(self, per_minute: float, burst: float = None):
+        self.capacity = per_minute if burst is None or per_minute <= 0 else burst
+        self.rate = per_minute / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: int) -> float:
+        """Take tokens if available; otherwise return seconds until they will be"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def reserve(self, amount: float, max_wait: float) -> Tuple[bool, float]:
+        """Take tokens now, going into debt so later callers queue behind; refuse past max_wait"""
+        if self.capacity <= 0:
+            return True, 0.0
+        self._refill()
+        wait = max(0.0, (amount - self.tokens) / self.rate)
+        if wait > max_wait:
+            return False, wait
+        self.tokens -= amount
+        return True, wait
+
+    def adjust(self, delta: int):
+        """Settle the difference between estimated and actual usage"""
+        if self.capacity > 0:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class ClientState:
+    """Queue, fair-share tag, quotas and usage for one caller"""
+
+    def __init__(self, client_id: str, weight: float, rpm: int, tpm: int):
+        self.client_id = client_id
+        self.weight = weight
+        self.heap = []                          # (key, seq, cost, future)
+        self.vfinish = 0.0                      # virtual finish tag of last dispatch
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.inflight = 0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.rejected = 0
+        self.last_seen = time.monotonic()
+
+    def head(self):
+        while self.heap and self.heap[0][3].done():
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    def queued(self) -> int:
+        return sum(1 for entry in self.heap if not entry[3].done())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'weight': self.weight,
+            'queued': self.queued(),
+            'inflight': self.inflight,
+            'requests': self.total_requests,
+            'tokens': self.total_tokens,
+            'rejected_quota': self.rejected,
+            'rpm_quota': self.requests.capacity or None,
+            'rpm_remaining': math.floor(self.requests.tokens) if self.requests.capacity > 0 else None,
+            'tpm_quota': self.tokens.capacity or None,
+            'tpm_remaining': math.floor(self.tokens.tokens) if self.tokens.capacity > 0 else None
+        }
+
+
+class QueryScheduler:
+    """Weighted fair queuing across clients, shortest-job-first with aging within each"""
+
+    def __init__(self, grok, aging_rate: float = None,
+                 max_request_tokens: int = None, budget_per_minute: int = None):
+        if aging_rate is None:
+            aging_rate = float(os.getenv('GROK_SCHED_AGING_RATE', '200'))
+        if max_request_tokens is None:
+            max_request_tokens = int(os.getenv('GROK_MAX_REQUEST_TOKENS', '32768'))
+        if budget_per_minute is None:
+            budget_per_minute = int(os.getenv('GROK_TOKEN_BUDGET_PER_MIN', '0'))
+        self.grok = grok
+        self.estimator = TokenEstimator()
+        self.aging_rate = aging_rate            # tokens of priority gained per second waited
+        self.max_request_tokens = max_request_tokens
+        self.budget = TokenBucket(budget_per_minute)
+
+        # Per-client defaults, with overrides such as {"alice": {"weight": 2, "rpm": 120}}
+        self.client_defaults = {
+            'weight': 1.0,
+            'rpm': int(os.getenv('GROK_CLIENT_RPM', '0')),
+            'tpm': int(os.getenv('GROK_CLIENT_TPM', '0'))
+        }
+        self.client_overrides = json.loads(os.getenv('GROK_CLIENTS', '{}'))
+        self.max_clients = int(os.getenv('GROK_MAX_TRACKED_CLIENTS', '1024'))
+        self.clients: 'OrderedDict[str, ClientState]' = OrderedDict()
+
+        self.inflight = 0
+        self.vtime = 0.0                        # self-clocked fair queuing virtual time
+        self.counter = itertools.count()
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+        self.dispatched = 0
+        self.rejected = 0
+        self.estimate_error = 0.0               # EWMA of |actual - estimate| / actual
+
+    @property
+    def max_inflight(self) -> int:
+        """Slots follow the adaptive upstream limit (it only moves as calls finish, which redispatches)"""
+        return self.grok.limiter.limit
+
+    def client(self, client_id: str) -> ClientState:
+        state = self.clients.get(client_id)
+        if state is None:
+            config = dict(self.client_defaults, **self.client_overrides.get(client_id, {}))
+            state = ClientState(client_id, float(config['weight']), int(config['rpm']), int(config['tpm']))
+            self.clients[client_id] = state
+            self._prune()
+        self.clients.move_to_end(client_id)
+        state.last_seen = time.monotonic()
+        return state
+
+    def _prune(self):
+        """Forget the least recently seen idle clients beyond the tracking cap"""
+        for client_id in list(self.clients):
+            if len(self.clients) <= self.max_clients:
+                break
+            state = self.clients[client_id]
+            if state.inflight == 0 and state.head() is None:
+                del self.clients[client_id]
+
+    def _next_client(self) -> Optional[ClientState]:
+        """The backlogged client whose head query would finish first in virtual time"""
+        best, best_tag = None, None
+        for state in self.clients.values():
+            head = state.head()
+            if head is None:
+                continue
+            tag = max(self.vtime, state.vfinish) + head[2] / state.weight
+            if best_tag is None or tag < best_tag:
+                best, best_tag = state, tag
+        return best
+
+    def _dispatch(self):
+        self._wakeup = None
+        while self.inflight < self.max_inflight:
+            state = self._next_client()
+            if state is None:
+                return
+            key, seq, cost, waiter = state.head()
+            delay = self.budget.take(cost)
+            if delay > 0:
+                # Global budget exhausted: retry once enough tokens have refilled
+                self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            heapq.heappop(state.heap)
+            state.vfinish = max(self.vtime, state.vfinish) + cost / state.weight
+            self.vtime = max(self.vtime, state.vfinish - cost / state.weight)
+            self.inflight += 1
+            state.inflight += 1
+            waiter.set_result(None)
+
+    def _check_quota(self, state: ClientState, cost: int):
+        delay = state.requests.take(1)
+        if delay > 0:
+            state.rejected += 1
+            raise QuotaExceeded(state.client_id, 'request quota exceeded', math.ceil(delay))
+        delay = state.tokens.take(cost)
+        if delay > 0:
+            state.requests.adjust(-1)
+            state.rejected += 1
+            raise QuotaExceeded(state.client_id, 'token quota exceeded', math.ceil(delay))
+
+    async def _acquire(self, state: ClientState, cost: int):
+        # Aging: waiting t seconds is worth aging_rate * t tokens. Folding the enqueue
+        # time into the key keeps heap order stable as everyone ages together.
+        key = cost + self.aging_rate * time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(state.heap, (key, next(self.counter), cost, waiter))
+        if self._wakeup is None:
+            self._dispatch()
+        try:
+            with span('scheduler.wait', client=state.client_id, est_tokens=cost,
+                      queued=state.queued()):
+                await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(state)
+            raise
+
+    def _release(self, state: ClientState):
+        self.inflight -= 1
+        state.inflight -= 1
+        if self._wakeup is None:
+            self._dispatch()
+
+    async def chat_completion(self, query: str, client_id: str = 'anonymous', **kwargs) -> Dict[str, Any]:
+        """Estimate, check the caller's quota, wait for a fair slot, then call GrokAPI"""
+        if kwargs.get('use_cache', True):
+            # Cached answers cost nothing upstream, so they skip quotas and the queue
+            cached = self.grok.cached(query, kwargs.get('model', DEFAULT_MODEL))
+            if cached is not None:
+                return cached
+
+        cost = self.estimator.estimate(query)
+        if cost > self.max_request_tokens:
+            self.rejected += 1
+            return {
+                'success': False,
+                'error': f'Query too large: ~{cost} tokens (limit {self.max_request_tokens})'
+            }
+
+        state = self.client(client_id)
+        self._check_quota(state, cost)
+        await self._acquire(state, cost)
+        self.dispatched += 1
+        state.total_requests += 1
+        try:
+            result = await self.grok.chat_completion(query, **kwargs)
+        finally:
+            self._release(state)
+
+        usage = result.get('usage') or {}
+        if result.get('cached'):
+            # Shared another caller's in-flight answer: nothing was spent
+            self.budget.adjust(-cost)
+            state.tokens.adjust(-cost)
+        elif usage.get('total_tokens'):
+            actual = usage['total_tokens']
+            self.budget.adjust(actual - cost)
+            state.tokens.adjust(actual - cost)
+            state.total_tokens += actual
+            self.estimate_error = 0.9 * self.estimate_error + 0.1 * abs(actual - cost) / actual
+            self.estimator.observe(query, usage)
+        elif not result.get('success'):
+            # Failed calls consume nothing from the budget or the quota
+            self.budget.adjust(-cost)
+            state.tokens.adjust(-cost)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'inflight': self.inflight,
+            'max_inflight': self.max_inflight,
+            'queued': sum(state.queued() for state in self.clients.values()),
+            'dispatched': self.dispatched,
+            'rejected_oversize': self.rejected,
+            'budget_per_minute': self.budget.capacity,
+            'budget_remaining': round(self.budget.tokens) if self.budget.capacity > 0 else None,
+            'estimator_scale': round(self.estimator.scale, 3),
+            'avg_completion_tokens': round(self.estimator.avg_completion, 1),
+            'estimate_error': round(self.estimate_error, 3),
+            'clients': {client_id: state.stats() for client_id, state in self.clients.items()}
+        }
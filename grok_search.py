@@ -0,0 +1,370 @@
+"""
+Full-text search over answered queries: an incremental inverted index with BM25 ranking
+
+Each answer is indexed as it arrives and appended to a JSON-lines file, which
+is replayed on startup (and rewritten once evicted entries dominate it). The
+index holds at most max_docs entries and max_bytes of text; the oldest go
+first. Posting lists are kept in id order, so evicted entries are trimmed off
+their front lazily. Ids are assigned afresh in file order on every load, so
+lines appended by a draining predecessor during a restart never clash. Terms
+are scored rarest first, and a term found in more than max_scan documents only
+adds to the newest of them (or to documents the rarer terms already matched),
+which bounds the cost of any query.
+"""
+
+import asyncio
+import heapq
+import json
+import math
+import os
+import re
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+
+from grok_log import log
+
+TOKEN = re.compile(r'\w+')
+STOPWORDS = frozenset('a an and are as at be by for from has have in is it its of on or that the this '
+                      'to was were what when where which who why will with you your'.split())
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN.findall(text.lower()) if len(t) <= 40]
+
+
+class Doc:
+    """One answered query"""
+
+    __slots__ = ('ts', 'client', 'query', 'answer', 'length')
+
+    def __init__(self, ts: float, client: str, query: str, answer: str, length: int):
+        self.ts = ts
+        self.client = client
+        self.query = query
+        self.answer = answer
+        self.length = length
+
+
+class Postings:
+    """Doc ids (ascending) and term frequencies for one term"""
+
+    __slots__ = ('ids', 'tfs')
+
+    def __init__(self):
+        self.ids = array('q')
+        self.tfs = array('I')
+
+    def trim(self, first_live: int):
+        """Drop entries for evicted docs (all ids below first_live)"""
+        dead = bisect_left(self.ids, first_live)
+        if dead:
+            del self.ids[:dead]
+            del self.tfs[:dead]
+
+
+class SearchIndex:
+    """Inverted index over queries and answers, persisted as an append-only log"""
+
+    def __init__(self, path: str = None, max_docs: int = None, max_bytes: int = None):
+        if path is None:
+            path = os.getenv('GROK_SEARCH_FILE', 'grok_search.jsonl')
+        if max_docs is None:
+            max_docs = int(os.getenv('GROK_SEARCH_MAX_DOCS', '200000'))
+        if max_bytes is None:
+            max_bytes = int(os.getenv('GROK_SEARCH_MAX_BYTES', str(256 * 1024 * 1024)))
+        self.path = path
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = float(os.getenv('GROK_SEARCH_FLUSH_INTERVAL', '1'))
+        # Postings scored per term at most: a term in most documents scores only its newest ones
+        self.max_scan = int(os.getenv('GROK_SEARCH_MAX_SCAN', '20000'))
+
+        self.docs: Dict[int, Doc] = {}
+        self.order: deque = deque()
+        self.postings: Dict[str, Postings] = {}
+        self.next_id = 0
+        self.first_live = 0
+        self.text_bytes = 0
+        self.total_length = 0
+        self.evicted = 0
+        # Until start() has replayed the file, adds wait and the file is never rewritten
+        self.loading = True
+        # Off in a draining process: the successor owns the file and compacts it
+        self.compaction = True
+        # After a restart, the draining process still appends here: until it exits the file is not
+        # rewritten, and lines past what we loaded are ours (by id and ts) or its
+        self.predecessor: Optional[int] = None
+        self.loaded_bytes = 0
+        self.own: set = set()
+
+        # File work (appends, replay, compaction) runs on one thread, in order
+        self.io = ThreadPoolExecutor(1, thread_name_prefix='grok-search-io')
+        self.unwritten: List[str] = []
+        self.deferred: List[tuple] = []
+        self.logged_lines = 0
+        self._prune_keys: List[str] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def add(self, query: str, answer: str, client: str = '', ts: float = None):
+        """Index an answer now; it reaches the file on the next flush"""
+        if ts is None:
+            ts = time.time()
+        if self.loading:
+            # Ids must keep rising along every posting list: wait until the history is in
+            self.deferred.append((query, answer, client, ts))
+            return
+        doc_id = self._index(query, answer, client, ts)
+        if self.predecessor is not None:
+            self.own.add((doc_id, ts))
+        self.unwritten.append(self._line(doc_id, ts, client, query, answer))
+
+    @staticmethod
+    def _line(doc_id: int, ts: float, client: str, query: str, answer: str) -> str:
+        return json.dumps({'id': doc_id, 'ts': ts, 'client': client, 'query': query, 'answer': answer},
+                          ensure_ascii=False)
+
+    def _index(self, query: str, answer: str, client: str, ts: float) -> int:
+        doc_id = self.next_id
+        self.next_id += 1
+        # Words in the question count double: they say what the answer is about
+        query_terms = tokenize(query)
+        terms = Counter(query_terms * 2 + tokenize(answer))
+        length = sum(terms.values())
+        self.docs[doc_id] = Doc(ts, client, query, answer, length)
+        self.order.append(doc_id)
+        self.text_bytes += len(query) + len(answer)
+        self.total_length += length
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = Postings()
+            postings.ids.append(doc_id)
+            postings.tfs.append(tf)
+        self._evict()
+        return doc_id
+
+    def _evict(self):
+        while self.order and (len(self.docs) > self.max_docs or self.text_bytes > self.max_bytes):
+            doc = self.docs.pop(self.order.popleft())
+            self.text_bytes -= len(doc.query) + len(doc.answer)
+            self.total_length -= doc.length
+            self.evicted += 1
+        self.first_live = self.order[0] if self.order else self.next_id
+
+    def search(self, q: str, limit: int = 20) -> Dict[str, Any]:
+        started = time.perf_counter()
+        terms = list(dict.fromkeys(tokenize(q)))
+        meaningful = [t for t in terms if t not in STOPWORDS]
+        terms = meaningful or terms
+        n = len(self.docs)
+        avg_length = self.total_length / n if n else 1.0
+
+        lists = []
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.trim(self.first_live)
+            if postings.ids:
+                lists.append((len(postings.ids), term, postings))
+        # Rarest terms first: common terms then only score documents already matched
+        lists.sort(key=lambda item: item[0])
+
+        scores: Dict[int, float] = {}
+        docs = self.docs
+        truncated = False
+        for df, term, postings in lists:
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            ids, tfs = postings.ids, postings.tfs
+            if scores and df > 4 * len(scores):
+                # Only documents already matched: walk the postings from the oldest of them,
+                # or look each one up when that stretch is longer than the matches
+                first = bisect_left(ids, min(scores))
+                if df - first <= 4 * len(scores):
+                    matched = ((doc_id, tf) for doc_id, tf in zip(ids[first:], tfs[first:]) if doc_id in scores)
+                else:
+                    matched = ((doc_id, tfs[i]) for doc_id, i in ((d, bisect_left(ids, d)) for d in list(scores))
+                               if i < df and ids[i] == doc_id)
+                for doc_id, tf in list(matched):
+                    norm = K1 * (1 - B + B * docs[doc_id].length / avg_length)
+                    scores[doc_id] += idf * tf * (K1 + 1) / (tf + norm)
+                continue
+            if df > self.max_scan:
+                truncated = True
+                ids, tfs = ids[-self.max_scan:], tfs[-self.max_scan:]
+            for doc_id, tf in zip(ids, tfs):
+                norm = K1 * (1 - B + B * docs[doc_id].length / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (K1 + 1) / (tf + norm)
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        pattern = re.compile(r'\b(' + '|'.join(re.escape(t) for t in terms) + r')', re.IGNORECASE) if terms else None
+        results = []
+        for doc_id, score in top:
+            doc = docs[doc_id]
+            results.append({
+                'id': doc_id,
+                'ts': doc.ts,
+                'client': doc.client,
+                'query': doc.query[:300],
+                'snippet': self.snippet(doc.answer, pattern),
+                'score': round(score, 3)
+            })
+        return {
+            'q': q,
+            'matches': len(scores),
+            'truncated': truncated,
+            'results': results,
+            'indexed': n,
+            'loading': self.loading,
+            'took_ms': round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    @staticmethod
+    def snippet(text: str, pattern: Optional[re.Pattern], before: int = 60, after: int = 140) -> str:
+        """Text around the first match, whitespace collapsed"""
+        match = pattern.search(text) if pattern else None
+        start = max(0, match.start() - before) if match else 0
+        end = min(len(text), (match.start() if match else 0) + after)
+        piece = ' '.join(text[start:end].split())
+        return ('…' if start > 0 else '') + piece + ('…' if end < len(text) else '')
+
+    async def start(self):
+        """Replay the file in the background (searches see what is loaded so far), then flush periodically"""
+        loop = asyncio.get_running_loop()
+        entries = await loop.run_in_executor(self.io, self._read)
+        # Index in slices so the loop keeps serving while a large history loads
+        for i in range(0, len(entries), 2000):
+            for entry in entries[i:i + 2000]:
+                self._index(entry['query'], entry['answer'], entry.get('client', ''), entry['ts'])
+            await asyncio.sleep(0)
+        # Only a complete load clears this: a cancelled one must not let flush() compact a partial index
+        self.loading = False
+        deferred, self.deferred = self.deferred, []
+        for item in deferred:
+            self.add(*item)
+        log.info('search.loaded', docs=len(self.docs), evicted=self.evicted, lines=self.logged_lines)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    def _read(self) -> List[Dict[str, Any]]:
+        entries: Dict[tuple, Dict[str, Any]] = {}
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    # A line still being written is read again with the predecessor's tail
+                    self.loaded_bytes += len(line)
+                self.logged_lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # A torn last line from a crash
+                # The same answer written twice is loaded once
+                entries.setdefault((entry.get('id'), entry['ts']), entry)
+        return sorted(entries.values(), key=lambda e: e['ts'])
+
+    def _read_tail(self) -> List[Dict[str, Any]]:
+        """Lines the predecessor appended after we loaded the file"""
+        entries = []
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self.loaded_bytes)
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (entry.get('id'), entry['ts']) not in self.own:
+                        self.logged_lines += 1
+                        entries.append(entry)
+        except FileNotFoundError:
+            pass
+        return sorted(entries, key=lambda e: e['ts'])
+
+    def _append(self, lines: List[str]):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _rewrite(self, lines: List[str]):
+        tmp = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n' if lines else '')
+        os.replace(tmp, self.path)
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        if self.predecessor is not None and not self.loading and os.getppid() != self.predecessor:
+            # The predecessor has exited (we were re-parented): index what it wrote since our load
+            for entry in await loop.run_in_executor(self.io, self._read_tail):
+                self._index(entry['query'], entry['answer'], entry.get('client', ''), entry['ts'])
+            self.predecessor = None
+            self.own = set()
+        # Decide and snapshot before awaiting: adds arriving meanwhile belong to the next flush only
+        lines, self.unwritten = self.unwritten, []
+        if (self.compaction and not self.loading and self.predecessor is None
+                and self.logged_lines + len(lines) > 2 * max(len(self.docs), 1000)):
+            # Mostly evicted entries on disk: rewrite it with the live ones (which include lines)
+            live = [self._line(doc_id, d.ts, d.client, d.query, d.answer) for doc_id, d in self.docs.items()]
+            self.logged_lines = len(live)
+            await loop.run_in_executor(self.io, self._rewrite, live)
+        elif lines:
+            self.logged_lines += len(lines)
+            await loop.run_in_executor(self.io, self._append, lines)
+
+    def _prune_step(self, batch: int = 5000):
+        """Trim a slice of posting lists and forget terms only evicted docs used"""
+        if not self._prune_keys:
+            self._prune_keys = list(self.postings)
+        for term in self._prune_keys[-batch:]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.trim(self.first_live)
+                if not postings.ids:
+                    del self.postings[term]
+        del self._prune_keys[-batch:]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                log.error('search.flush_failed', error=str(e))
+            if self.evicted:
+                self._prune_step()
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # Stopped before the history loaded: keep what arrived meanwhile (ids are reassigned on load)
+        for query, answer, client, ts in self.deferred:
+            self.unwritten.append(self._line(-1, ts, client, query, answer))
+        self.deferred = []
+        try:
+            await self.flush()
+        finally:
+            self.io.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'file': self.path,
+            'docs': len(self.docs),
+            'max_docs': self.max_docs,
+            'terms': len(self.postings),
+            'text_bytes': self.text_bytes,
+            'max_bytes': self.max_bytes,
+            'evicted': self.evicted,
+            'lines_on_disk': self.logged_lines,
+            'unwritten': len(self.unwritten),
+            'loading': self.loading
+        }
@@ -0,0 +1,141 @@
+"""
+Mergeable streaming quantile sketches over sliding time windows
+
+Each sketch keeps counts in logarithmic buckets (the DDSketch scheme), so every
+quantile is within a fixed relative error of the true value. Memory depends on
+the value range, never on how many values were added. A window is a ring of
+per-slice sketches; old slices are dropped whole and live ones are merged on
+read.
+"""
+
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, Any, Iterable, Optional
+
+
+class QuantileSketch:
+    """Relative-error quantile sketch; merge() adds another sketch's counts"""
+
+    __slots__ = ('gamma', 'log_gamma', 'max_buckets', 'buckets', 'zeros', 'count', 'total', 'min', 'max')
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_buckets = max_buckets
+        self.buckets: Dict[int, int] = {}
+        # Values too small for a log bucket (including 0)
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        if value > 1e-9:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            if len(self.buckets) > self.max_buckets:
+                self._collapse()
+        else:
+            self.zeros += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self):
+        """Over the bucket budget: fold the lowest buckets together (high quantiles stay exact)"""
+        ordered = sorted(self.buckets)
+        spill = ordered[:len(ordered) - self.max_buckets + 1]
+        target = spill[-1]
+        self.buckets[target] += sum(self.buckets.pop(i) for i in spill[:-1])
+
+    def merge(self, other: 'QuantileSketch'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                # Bucket midpoint in the relative sense, clamped to what was actually seen
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class SlidingQuantiles:
+    """Quantiles over roughly the last window seconds, kept as slices that expire whole"""
+
+    def __init__(self, window: float = 300, slices: int = 10, relative_accuracy: float = 0.01):
+        self.window = window
+        self.slice_seconds = window / slices
+        self.accuracy = relative_accuracy
+        # (slice start, sketch), oldest first
+        self.slices: deque = deque(maxlen=slices)
+
+    def _current(self, now: float) -> QuantileSketch:
+        start = now - now % self.slice_seconds
+        if not self.slices or self.slices[-1][0] != start:
+            self.slices.append((start, QuantileSketch(self.accuracy)))
+        return self.slices[-1][1]
+
+    def add(self, value: float, now: float = None):
+        self._current(time.time() if now is None else now).add(value)
+
+    def merged(self, now: float = None) -> QuantileSketch:
+        now = time.time() if now is None else now
+        sketch = QuantileSketch(self.accuracy)
+        for start, part in self.slices:
+            if start > now - self.window:
+                sketch.merge(part)
+        return sketch
+
+    def summary(self, quantiles: Iterable[float] = (0.5, 0.95, 0.99), digits: int = 1) -> Dict[str, Any]:
+        sketch = self.merged()
+        out = {'n': sketch.count}
+        if sketch.count:
+            for q in quantiles:
+                out[f'p{q * 100:g}'.replace('.', '')] = round(sketch.quantile(q), digits)
+            out['mean'] = round(sketch.total / sketch.count, digits)
+            out['max'] = round(sketch.max, digits)
+        return out
+
+
+class MetricWindows:
+    """Named sliding sketches sharing one window"""
+
+    def __init__(self, names: Iterable[str], window: float = None, slices: int = None,
+                 relative_accuracy: float = None):
+        if window is None:
+            window = float(os.getenv('GROK_QUANTILE_WINDOW', '300'))
+        if slices is None:
+            slices = int(os.getenv('GROK_QUANTILE_SLICES', '10'))
+        if relative_accuracy is None:
+            relative_accuracy = float(os.getenv('GROK_QUANTILE_ACCURACY', '0.01'))
+        self.window = window
+        self.metrics = {name: SlidingQuantiles(window, slices, relative_accuracy) for name in names}
+
+    def record(self, name: str, value: float):
+        self.metrics[name].add(value)
+
+    def summary(self, quantiles: Iterable[float] = (0.5, 0.95, 0.99)) -> Dict[str, Any]:
+        out = {'window_s': self.window}
+        for name, sliding in self.metrics.items():
+            out[name] = sliding.summary(quantiles)
+        return out
@@ -0,0 +1,242 @@
+"""
+Append-only, time-indexed event store behind the timeline
+"""
+
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+KINDS = ('query', 'tool_call')
+
+
+class Chunk:
+    """Fixed-size block of events stored column by column"""
+
+    __slots__ = ('base', 'ts', 'kind', 'tool', 'client', 'clients', 'duration', 'tokens', 'ok', 'args')
+
+    def __init__(self, base: int):
+        self.base = base                 # sequence number of the first row
+        self.ts = array('d')             # wall-clock seconds, non-decreasing
+        self.kind = array('B')
+        self.tool = array('H')           # dictionary-encoded
+        self.client = array('I')         # encoded with this chunk's own dictionary
+        # Every WebSocket session is a new client id; kept per chunk so they go when the chunk does
+        self.clients = Dictionary()
+        self.duration = array('f')       # milliseconds
+        self.tokens = array('I')
+        self.ok = array('B')
+        self.args = []
+
+    def __len__(self):
+        return len(self.ts)
+
+
+class Dictionary:
+    """Interns repeated strings so columns hold small integers; released codes are reused"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[Optional[str]] = []
+        self.free: List[int] = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def encode(self, value: str) -> int:
+        code = self.ids.get(value)
+        if code is None:
+            if self.free:
+                code = self.free.pop()
+                self.values[code] = value
+            else:
+                code = len(self.values)
+                self.values.append(value)
+            self.ids[value] = code
+        return code
+
+    def release(self, code: int):
+        """Forget a value no stored row refers to any more"""
+        del self.ids[self.values[code]]
+        self.values[code] = None
+        self.free.append(code)
+
+
+class EventStore:
+    """Columnar event log with a time index and per-tool/per-kind postings"""
+
+    def __init__(self, max_events: int = None, chunk_size: int = None):
+        if max_events is None:
+            max_events = int(os.getenv('GROK_TIMELINE_MAX_EVENTS', '1000000'))
+        if chunk_size is None:
+            chunk_size = int(os.getenv('GROK_TIMELINE_CHUNK', '4096'))
+        self.max_events = max_events
+        self.chunk_size = chunk_size
+        self.chunks: List[Chunk] = []
+        self.chunk_starts = array('d')   # first timestamp of each chunk
+        self.next_seq = 0
+        self.tools = Dictionary()
+        # Sorted sequence numbers per tool and per kind, for filtered range queries
+        self.postings: Dict[Tuple[str, int], array] = {}
+
+        # Wall-clock anchor advanced by the monotonic clock, so timestamps never go backwards
+        self.wall_anchor = time.time()
+        self.mono_anchor = time.monotonic()
+
+    def now(self) -> float:
+        return self.wall_anchor + (time.monotonic() - self.mono_anchor)
+
+    @property
+    def first_seq(self) -> int:
+        return self.chunks[0].base if self.chunks else self.next_seq
+
+    def __len__(self):
+        return self.next_seq - self.first_seq
+
+    def append(self, kind: str, tool: str, args: str = '', client: str = '',
+               duration_ms: float = 0.0, tokens: int = 0, ok: bool = True) -> int:
+        if not self.chunks or len(self.chunks[-1]) >= self.chunk_size:
+            self.chunks.append(Chunk(self.next_seq))
+            self.chunk_starts.append(self.now())
+            self._enforce_retention()
+        chunk = self.chunks[-1]
+        seq = self.next_seq
+        tool_id = self.tools.encode(tool)
+        kind_id = KINDS.index(kind)
+
+        chunk.ts.append(self.now())
+        chunk.kind.append(kind_id)
+        chunk.tool.append(tool_id)
+        chunk.client.append(chunk.clients.encode(client))
+        chunk.duration.append(duration_ms)
+        chunk.tokens.append(tokens)
+        chunk.ok.append(1 if ok else 0)
+        chunk.args.append(args)
+
+        self.postings.setdefault(('tool', tool_id), array('Q')).append(seq)
+        self.postings.setdefault(('kind', kind_id), array('Q')).append(seq)
+        self.next_seq += 1
+        return seq
+
+    def _enforce_retention(self):
+        """Drop whole chunks from the head once over the event cap"""
+        dropped = False
+        while len(self.chunks) > 1 and len(self) - len(self.chunks[0]) >= self.max_events:
+            self.chunks.pop(0)
+            self.chunk_starts.pop(0)
+            dropped = True
+        if dropped:
+            for key, seqs in list(self.postings.items()):
+                del seqs[:bisect_left(seqs, self.first_seq)]
+                if not seqs and key[0] == 'tool':
+                    # No stored event uses this tool any more: free its code for reuse
+                    del self.postings[key]
+                    self.tools.release(key[1])
+
+    def _locate(self, seq: int) -> Tuple[Chunk, int]:
+        index = (seq - self.first_seq) // self.chunk_size
+        chunk = self.chunks[index]
+        return chunk, seq - chunk.base
+
+    def _seq_at(self, ts: float, right: bool = False) -> int:
+        """First sequence number with timestamp >= ts (> ts when right)"""
+        if not self.chunks:
+            return self.next_seq
+        search = bisect_right if right else bisect_left
+        index = max(0, bisect_right(self.chunk_starts, ts) - 1)
+        for chunk in self.chunks[index:index + 2]:
+            offset = search(chunk.ts, ts)
+            if offset < len(chunk):
+                return chunk.base + offset
+        return self.next_seq
+
+    def row(self, seq: int) -> Dict[str, Any]:
+        chunk, i = self._locate(seq)
+        ts = chunk.ts[i]
+        started = ts - chunk.duration[i] / 1000
+        return {
+            'id': seq,
+            'ts': round(ts, 6),
+            # The dashboard shows when the call started
+            'time': datetime.fromtimestamp(started).strftime('%H:%M:%S'),
+            'kind': KINDS[chunk.kind[i]],
+            'tool': self.tools.values[chunk.tool[i]],
+            'args': chunk.args[i],
+            'client': chunk.clients.values[chunk.client[i]],
+            'duration_ms': round(chunk.duration[i], 1),
+            'tokens': chunk.tokens[i],
+            'ok': bool(chunk.ok[i])
+        }
+
+    def query(self, start: float = None, end: float = None, tool: str = None, kind: str = None,
+              limit: int = 100, cursor: int = None, descending: bool = False) -> Dict[str, Any]:
+        """Events with start <= ts < end, optionally filtered, one page at a time"""
+        lo = self.first_seq if start is None else self._seq_at(start)
+        hi = self.next_seq if end is None else self._seq_at(end)
+        if cursor is not None:
+            if descending:
+                hi = min(hi, cursor)
+            else:
+                lo = max(lo, cursor)
+        lo = max(lo, self.first_seq)
+
+        # Walk the narrowest index available instead of the whole range
+        candidates = None
+        if tool is not None:
+            tool_id = self.tools.ids.get(tool)
+            candidates = self.postings.get(('tool', tool_id), array('Q')) if tool_id is not None else array('Q')
+        elif kind is not None:
+            candidates = self.postings.get(('kind', KINDS.index(kind)), array('Q')) if kind in KINDS else array('Q')
+        kind_id = KINDS.index(kind) if kind in KINDS else None
+
+        if candidates is None:
+            seqs = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        else:
+            first, last = bisect_left(candidates, lo), bisect_left(candidates, hi)
+            seqs = (candidates[i] for i in (range(last - 1, first - 1, -1) if descending else range(first, last)))
+
+        events = []
+        next_cursor = None
+        for seq in seqs:
+            if len(events) >= limit:
+                next_cursor = seq + 1 if descending else seq
+                break
+            if kind_id is not None and tool is not None:
+                chunk, i = self._locate(seq)
+                if chunk.kind[i] != kind_id:
+                    continue
+            events.append(self.row(seq))
+        return {'events': events, 'next_cursor': next_cursor}
+
+    def tail(self, count: int = 5, kind: str = 'tool_call') -> List[Dict[str, Any]]:
+        """Most recent events of a kind, oldest first (what the dashboard timeline shows)"""
+        page = self.query(kind=kind, limit=count, descending=True)
+        return [{'time': e['time'], 'tool': e['tool'], 'args': e['args']} for e in reversed(page['events'])]
+
+    def nbytes(self) -> int:
+        """Approximate memory held by columns, args strings and postings"""
+        total = 0
+        # Copied first: /debug/memory calls this from a worker while the loop appends
+        for chunk in list(self.chunks):
+            for column in (chunk.ts, chunk.kind, chunk.tool, chunk.client, chunk.duration, chunk.tokens, chunk.ok):
+                total += column.buffer_info()[1] * column.itemsize
+            total += sys.getsizeof(chunk.args) + sum(sys.getsizeof(a) for a in chunk.args)
+            total += sys.getsizeof(chunk.clients.ids) + sys.getsizeof(chunk.clients.values)
+            total += sum(sys.getsizeof(v) for v in chunk.clients.values)
+        for seqs in list(self.postings.values()):
+            total += seqs.buffer_info()[1] * seqs.itemsize
+        return total
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'events': len(self),
+            'first_id': self.first_seq,
+            'next_id': self.next_seq,
+            'chunks': len(self.chunks),
+            'max_events': self.max_events,
+            'tools': len(self.tools),
+            'clients': len({c for chunk in self.chunks for c in chunk.clients.values})
+        }
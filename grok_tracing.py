@@ -0,0 +1,173 @@
+"""
+Lightweight per-request tracing for the Grok Mind query pipeline
+"""
+
+import os
+import random
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import aiohttp
+
+# Trace for the query currently being handled (None when unsampled)
+current_trace: ContextVar[Optional['Trace']] = ContextVar('current_trace', default=None)
+
+
+class Trace:
+    """A single sampled query with its timed stages"""
+
+    def __init__(self, name: str, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.attrs = attrs
+        self.wall_time = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.spans = []  # (name, start_ns, end_ns, attrs)
+
+    def add_span(self, name: str, start_ns: int, end_ns: int, **attrs):
+        self.spans.append((name, start_ns, end_ns, attrs))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        start = time.perf_counter_ns()
+        try:
+            yield attrs
+        finally:
+            self.add_span(name, start, time.perf_counter_ns(), **attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end_ns = self.end_ns or time.perf_counter_ns()
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'attrs': self.attrs,
+            'started_at': datetime.fromtimestamp(self.wall_time).isoformat(timespec='milliseconds'),
+            'duration_ms': round((end_ns - self.start_ns) / 1e6, 3),
+            'spans': [
+                {
+                    'name': name,
+                    'offset_ms': round((start - self.start_ns) / 1e6, 3),
+                    'duration_ms': round((end - start) / 1e6, 3),
+                    'attrs': span_attrs
+                }
+                for name, start, end, span_attrs in self.spans
+            ]
+        }
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a stage of the current trace; a no-op when the query is unsampled"""
+    trace = current_trace.get()
+    if trace is None:
+        yield attrs
+        return
+    with trace.span(name, **attrs) as span_attrs:
+        yield span_attrs
+
+
+class Tracer:
+    """Samples queries and keeps finished traces in a bounded ring buffer"""
+
+    def __init__(self, capacity: int = None, sample_rate: float = None):
+        if capacity is None:
+            capacity = int(os.getenv('GROK_TRACE_BUFFER', '256'))
+        if sample_rate is None:
+            sample_rate = float(os.getenv('GROK_TRACE_SAMPLE_RATE', '0.1'))
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.traces = deque(maxlen=capacity)
+        self.sampled = 0
+        self.skipped = 0
+
+    def start(self, name: str, **attrs) -> Optional[Trace]:
+        """Start a trace for a new query and make it current, if sampled"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            self.skipped += 1
+            current_trace.set(None)
+            return None
+        self.sampled += 1
+        trace = Trace(name, **attrs)
+        current_trace.set(trace)
+        return trace
+
+    def finish(self, trace: Optional[Trace]):
+        if trace is None:
+            return
+        trace.end_ns = time.perf_counter_ns()
+        self.traces.append(trace)
+        if current_trace.get() is trace:
+            current_trace.set(None)
+
+    def recent(self, limit: int = 50) -> List[Trace]:
+        return list(self.traces)[-limit:]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'sample_rate': self.sample_rate,
+            'buffered': len(self.traces),
+            'capacity': self.traces.maxlen,
+            'sampled': self.sampled,
+            'skipped': self.skipped
+        }
+
+    @staticmethod
+    def to_chrome(traces: List[Trace]) -> Dict[str, Any]:
+        """Export traces as Chrome trace-event JSON (chrome://tracing, Perfetto)"""
+        events = []
+        for tid, trace in enumerate(traces, start=1):
+            end_ns = trace.end_ns or time.perf_counter_ns()
+            events.append({
+                'name': trace.name, 'cat': 'query', 'ph': 'X', 'pid': 1, 'tid': tid,
+                'ts': trace.start_ns / 1000, 'dur': (end_ns - trace.start_ns) / 1000,
+                'args': dict(trace.attrs, trace_id=trace.trace_id)
+            })
+            for name, start, end, attrs in trace.spans:
+                events.append({
+                    'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': 1, 'tid': tid,
+                    'ts': start / 1000, 'dur': (end - start) / 1000, 'args': attrs
+                })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def aiohttp_trace_config() -> aiohttp.TraceConfig:
+    """Record DNS, connect (TCP + TLS) and time-to-first-byte spans for client requests"""
+
+    async def on_dns_start(session, ctx, params):
+        ctx.dns_start = time.perf_counter_ns()
+
+    async def on_dns_end(session, ctx, params):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span('upstream.dns', ctx.dns_start, time.perf_counter_ns(), host=params.host)
+
+    async def on_connect_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter_ns()
+
+    async def on_connect_end(session, ctx, params):
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_span('upstream.connect', ctx.connect_start, time.perf_counter_ns())
+
+    async def on_headers_sent(session, ctx, params):
+        ctx.sent = time.perf_counter_ns()
+
+    async def on_request_end(session, ctx, params):
+        trace = current_trace.get()
+        if trace is not None and hasattr(ctx, 'sent'):
+            trace.add_span('upstream.ttfb', ctx.sent, time.perf_counter_ns(),
+                           status=params.response.status)
+
+    config = aiohttp.TraceConfig()
+    config.on_dns_resolvehost_start.append(on_dns_start)
+    config.on_dns_resolvehost_end.append(on_dns_end)
+    config.on_connection_create_start.append(on_connect_start)
+    config.on_connection_create_end.append(on_connect_end)
+    config.on_request_headers_sent.append(on_headers_sent)
+    config.on_request_end.append(on_request_end)
+    return config
@@ -0,0 +1,198 @@
+"""
+Pluggable HTTP transports for upstream Grok API calls
+"""
+
+import os
+import ssl
+import time
+from typing import Dict, Any, List, Optional
+
+import aiohttp
+
+from grok_log import log
+from grok_tracing import span, current_trace, aiohttp_trace_config
+
+try:
+    import httpx
+    import h2  # noqa: F401  (httpx needs it for http2=True)
+except ImportError:
+    httpx = None
+
+
+class UpstreamResponse:
+    """Status, headers and raw body of one upstream call"""
+
+    __slots__ = ('status', 'headers', 'body')
+
+    def __init__(self, status: int, headers, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def text(self) -> str:
+        return self.body.decode('utf-8', errors='replace')
+
+
+class Transport:
+    """Interface behind GrokAPI.chat_completion"""
+
+    name = 'base'
+
+    def __init__(self):
+        self.connections_opened = 0
+        self.requests = 0
+
+    async def request(self, method: str, url: str, headers: Dict[str, str],
+                      body: bytes = None) -> UpstreamResponse:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'transport': self.name,
+            'connections_opened': self.connections_opened,
+            'requests': self.requests
+        }
+
+
+def _insecure_ssl_context() -> ssl.SSLContext:
+    # Create SSL context that bypasses certificate verification
+    ssl_context = ssl.create_default_context()
+    ssl_context.check_hostname = False
+    ssl_context.verify_mode = ssl.CERT_NONE
+    return ssl_context
+
+
+class AiohttpTransport(Transport):
+    """HTTP/1.1 keep-alive pool over aiohttp (the default)"""
+
+    name = 'aiohttp'
+
+    def __init__(self, pool_size: int, keepalive_timeout: float, dns_ttl: int):
+        super().__init__()
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_ttl = dns_ttl
+        self.trace_config = aiohttp_trace_config()
+        self.trace_config.on_connection_create_end.append(self._on_connection)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def _on_connection(self, session, ctx, params):
+        self.connections_opened += 1
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session, created on first use inside the event loop"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=_insecure_ssl_context(),
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_ttl
+            )
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  trace_configs=[self.trace_config])
+        return self._session
+
+    async def request(self, method, url, headers, body=None):
+        with span('upstream.session'):
+            session = self._get_session()
+        self.requests += 1
+        async with session.request(method, url, headers=headers, data=body) as response:
+            with span('upstream.body'):
+                data = await response.read()
+            return UpstreamResponse(response.status, response.headers, data)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class Http2Transport(Transport):
+    """Multiplexes concurrent requests over a few HTTP/2 connections (needs httpx[http2])"""
+
+    name = 'http2'
+
+    def __init__(self, max_connections: int, keepalive_timeout: float, prior_knowledge: bool):
+        super().__init__()
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        # Cleartext endpoints have no ALPN, so speak h2c directly
+        self.prior_knowledge = prior_knowledge
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http1=not self.prior_knowledge,
+                http2=True,
+                verify=_insecure_ssl_context(),
+                timeout=None,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    keepalive_expiry=self.keepalive_timeout)
+            )
+        return self._client
+
+    def _tracer(self):
+        """httpcore trace callback mapping connection events onto our spans"""
+        started = {}
+
+        async def on_event(event: str, info: Dict[str, Any]):
+            if event == 'connection.connect_tcp.complete':
+                self.connections_opened += 1
+            trace = current_trace.get()
+            if trace is None:
+                return
+            stage, _, phase = event.rpartition('.')
+            now = time.perf_counter_ns()
+            if phase == 'started':
+                started[stage] = now
+            elif phase == 'complete' and stage in started:
+                name = SPAN_NAMES.get(stage.split('.', 1)[-1])
+                if name:
+                    trace.add_span(name, started.pop(stage), now)
+
+        return on_event
+
+    async def request(self, method, url, headers, body=None):
+        with span('upstream.session'):
+            client = self._get_client()
+        self.requests += 1
+        async with client.stream(method, url, headers=headers, content=body,
+                                 extensions={'trace': self._tracer()}) as response:
+            with span('upstream.body', http_version=response.http_version):
+                data = await response.aread()
+            return UpstreamResponse(response.status_code, response.headers, data)
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+SPAN_NAMES = {
+    'connect_tcp': 'upstream.connect',
+    'start_tls': 'upstream.tls',
+    'receive_response_headers': 'upstream.ttfb'
+}
+
+
+def make_transport(endpoints: List[str], pool_size: int, keepalive_timeout: float,
+                   dns_ttl: int, kind: str = None) -> Transport:
+    """Build the transport named by GROK_UPSTREAM_TRANSPORT (aiohttp or http2)"""
+    if kind is None:
+        kind = os.getenv('GROK_UPSTREAM_TRANSPORT', 'aiohttp')
+    if kind == 'http2':
+        if httpx is not None:
+            return Http2Transport(
+                max_connections=int(os.getenv('GROK_H2_CONNECTIONS', '2')),
+                keepalive_timeout=keepalive_timeout,
+                prior_knowledge=all(url.startswith('http://') for url in endpoints)
+            )
+        log.warning('transport.fallback', requested='http2', using='aiohttp',
+                    error='HTTP/2 transport needs `pip install httpx[http2]`')
+    elif kind != 'aiohttp':
+        raise ValueError(f'Unknown GROK_UPSTREAM_TRANSPORT: {kind}')
+    return AiohttpTransport(pool_size, keepalive_timeout, dns_ttl)
@@ -0,0 +1,141 @@
+"""
+Keeps answers to popular standing queries fresh in the cache ahead of expiry
+"""
+
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from grok_api import DEFAULT_MODEL
+from grok_scheduler import TokenBucket
+
+WARMER_CLIENT = 'cache-warmer'
+
+
+class QueryWarmer:
+    """Learns frequent queries from traffic (plus a configured list) and refreshes them in the background"""
+
+    def __init__(self, scheduler, interval: float = None, top: int = None,
+                 tokens_per_hour: int = None):
+        if interval is None:
+            interval = float(os.getenv('GROK_WARM_INTERVAL', '5'))
+        if top is None:
+            top = int(os.getenv('GROK_WARM_TOP', '10'))
+        if tokens_per_hour is None:
+            tokens_per_hour = int(os.getenv('GROK_WARM_TOKENS_PER_HOUR', '50000'))
+        self.scheduler = scheduler
+        self.cache = scheduler.grok.cache
+        self.interval = interval
+        self.top = top
+        self.min_hits = float(os.getenv('GROK_WARM_MIN_HITS', '3'))
+        self.half_life = float(os.getenv('GROK_WARM_HALF_LIFE', '3600'))
+        self.max_tracked = int(os.getenv('GROK_WARM_MAX_TRACKED', '2048'))
+        # Refresh once less than this share of the TTL is left
+        self.ahead = float(os.getenv('GROK_WARM_AHEAD', '0.25'))
+        self.configured: List[str] = json.loads(os.getenv('GROK_WARM_QUERIES', '[]'))
+        self.budget = TokenBucket(tokens_per_hour / 60.0, burst=tokens_per_hour)
+
+        # query -> (decayed hit count, last update), monotonic clock
+        self.scores: Dict[str, Tuple[float, float]] = {}
+        self.refreshing: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.failed = 0
+        self.skipped_budget = 0
+        self.tokens_spent = 0
+
+    def enabled(self) -> bool:
+        return self.cache.ttl > 0 and self.interval > 0 and (self.top > 0 or bool(self.configured))
+
+    def _score(self, query: str, now: float) -> float:
+        score, updated = self.scores.get(query, (0.0, now))
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def observe(self, query: str):
+        """Count a query from a real caller"""
+        if not query or not self.top:
+            return
+        now = time.monotonic()
+        self.scores[query] = (self._score(query, now) + 1.0, now)
+        if len(self.scores) > self.max_tracked:
+            # Forget the coldest half rather than paying for an eviction on every miss
+            ranked = sorted(self.scores, key=lambda q: self._score(q, now))
+            for cold in ranked[:len(ranked) // 2]:
+                del self.scores[cold]
+
+    def candidates(self) -> List[str]:
+        """Configured queries, then the most popular learned ones"""
+        now = time.monotonic()
+        learned = sorted(((self._score(q, now), q) for q in self.scores), reverse=True)
+        popular = [q for score, q in learned[:self.top] if score >= self.min_hits]
+        return list(dict.fromkeys(self.configured + popular))
+
+    def due(self, query: str) -> bool:
+        remaining = self.cache.expires_in(query, DEFAULT_MODEL)
+        return remaining is None or remaining <= self.cache.ttl * self.ahead
+
+    def start(self):
+        if self._task is None and self.enabled():
+            self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            for query in self.candidates():
+                if query in self.refreshing or not self.due(query):
+                    continue
+                cost = self.scheduler.estimator.estimate(query)
+                if self.budget.take(cost) > 0:
+                    # Out of warming budget: the next real caller pays instead
+                    self.skipped_budget += 1
+                    break
+                self.refreshing.add(query)
+                asyncio.create_task(self._refresh(query, cost))
+
+    async def _refresh(self, query: str, cost: int):
+        try:
+            # Through the scheduler, so warming queues fairly and counts against the global budget
+            result = await self.scheduler.chat_completion(query, client_id=WARMER_CLIENT, use_cache=False)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        finally:
+            self.refreshing.discard(query)
+        spent = (result.get('usage') or {}).get('total_tokens', 0)
+        self.budget.adjust(spent - cost)
+        self.tokens_spent += spent
+        if result.get('success'):
+            self.cache.put(query, DEFAULT_MODEL, result)
+            self.refreshed += 1
+        else:
+            self.failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'enabled': self.enabled(),
+            'running': self._task is not None,
+            'configured': len(self.configured),
+            'tracked': len(self.scores),
+            'refreshed': self.refreshed,
+            'failed': self.failed,
+            'skipped_budget': self.skipped_budget,
+            'tokens_spent': self.tokens_spent,
+            'budget_per_hour': round(self.budget.capacity),
+            'budget_remaining': round(self.budget.tokens),
+            'queries': [
+                {
+                    'query': q[:80],
+                    'score': round(self._score(q, now), 2),
+                    'expires_in_s': None if self.cache.expires_in(q, DEFAULT_MODEL) is None
+                    else round(self.cache.expires_in(q, DEFAULT_MODEL), 1)
+                }
+                for q in self.candidates()
+            ]
+        }